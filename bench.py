@@ -0,0 +1,198 @@
+"""Replays recorded key traces through doom.py headlessly and reports frame times.
+
+    python bench.py                      # every trace in traces/
+    python bench.py traces/rotate.txt --json run.json
+    python bench.py --compare old.json
+
+Without hpprime doom.py picks the NumPy framebuffer backend, so this runs on any
+desktop. The run is deterministic: every trace starts from its own pose with a
+cold texture cache and the keys it holds are fed to backend.keys frame by frame.
+
+A trace is a text file like the maps: # comments, a "pose x y r" line (r in
+degrees) and then "frames [key ...]" lines, holding those keys for that many
+frames. Key numbers are the ISKEYDOWN ones game_frame() reads.
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+
+from render_headless import load_doom
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),"traces")
+DRAW_CALLS = ("fillrect","pixel","texel","poly","strip","invert","copy","load_texture","column","blit")
+
+def read_trace(path):
+    """Returns (pose, steps) where pose is (x,y,r degrees) and steps a list of (frames, keys)."""
+    pose = (0,0,0)
+    steps = []
+    f = open(path)
+    for line in f:
+        line = line.split("#")[0].split()
+        if not line:
+            continue
+        if line[0] == "pose":
+            pose = tuple(float(v) for v in line[1:4])
+        else:
+            steps.append((int(line[0]),set(int(k) for k in line[1:])))
+    f.close()
+    return pose, steps
+
+def percentile(values,p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    i = max(0,min(len(values)-1,math.ceil(p * len(values) / 100) - 1))
+    return values[i]
+
+class Probe:
+    """Counts backend draw calls. Stage times and render counters come from doom.profiler."""
+    def __init__(self,doom):
+        self.calls = dict((name,0) for name in DRAW_CALLS)
+        for name in DRAW_CALLS:
+            self.count(doom.backend,name)
+
+    def count(self,obj,name):
+        func = getattr(obj,name)
+        def counted(*args):
+            self.calls[name] += 1
+            return func(*args)
+        setattr(obj,name,counted)
+
+def reset(doom,pose):
+    """Puts the game back to a known state: player at pose, cold texture cache, nothing cached to reuse."""
+    doom.plr.x, doom.plr.y = pose[0], pose[1]
+    doom.plr.r = pose[2] * doom.RAD_CONST
+    doom.tree = doom.TextureTree(doom.backend)
+    for wall in doom.level:
+        if wall.texture not in doom.tree.tree:
+            doom.tree.add_texture(wall.texture)
+    doom.cam.columns = doom.ColumnCache(doom.backend)
+    doom.frame_cache = doom.FrameCache()
+    doom.backend.keys = set()
+
+def run_trace(doom,probe,path):
+    """Plays one trace and returns its result dict."""
+    pose, steps = read_trace(path)
+    reset(doom,pose)
+    calls0 = dict(probe.calls)
+    profiler = doom.profiler
+    profiler.reset()
+    evals0 = doom.backend.evals
+    frames = []
+    for count, keys in steps:
+        doom.backend.keys = keys
+        for i in range(count):
+            t = time.perf_counter()
+            doom.game_frame()
+            frames.append(time.perf_counter() - t)
+    calls = probe.calls
+    ms = sorted(t * 1000 for t in frames)
+    total = profiler.total
+    drawn = max(1,profiler.frames)
+    return {
+        "frames": len(frames),
+        "frame_ms": {"p50": percentile(ms,50), "p90": percentile(ms,90), "p99": percentile(ms,99),
+                     "max": ms[-1] if ms else 0, "mean": sum(ms) / len(ms) if ms else 0},
+        "evals": doom.backend.evals - evals0,
+        "evals_per_frame": (doom.backend.evals - evals0) / max(1,len(frames)),
+        "draw_calls": dict((name,calls[name] - calls0[name]) for name in DRAW_CALLS),
+        "stage_ms": {"traversal": (total["frame"] - total["projection"] - total["rasterisation"]) * 1000,
+                     "projection": total["projection"] * 1000, "rasterisation": total["rasterisation"] * 1000},
+        "per_drawn_frame": dict((name,total[name] / drawn) for name in doom.Profiler.COUNTERS),
+        "frames_rendered": doom.frame_cache.rendered,
+        "frames_reused": doom.frame_cache.reused,
+        "columns": doom.cam.columns.stats(),
+        "end_pose": [doom.plr.x, doom.plr.y, doom.plr.r / doom.RAD_CONST],
+    }
+
+def time_build(doom,repeat=5):
+    """Best of repeat BSP builds of the loaded level, in ms, with the same settings the game uses."""
+    best = None
+    for i in range(repeat):
+        builder = doom.BSPBuilder(doom.bsp_builder.split_cost,doom.bsp_builder.balance_cost,doom.bsp_builder.sample)
+        t = time.perf_counter()
+        doom.build_bsp(doom.level,builder)
+        t = time.perf_counter() - t
+        if best is None or t < best:
+            best = t
+    return best * 1000
+
+def compare(old,new):
+    """Prints p50 and evals per frame for each trace in both result sets."""
+    print("{0:<12} {1:>10} {2:>10} {3:>8} {4:>10} {5:>10}".format("trace","p50 old","p50 new","change","evals old","evals new"))
+    for name in sorted(new["traces"]):
+        if name not in old["traces"]:
+            continue
+        a = old["traces"][name]
+        b = new["traces"][name]
+        p0 = a["frame_ms"]["p50"]
+        p1 = b["frame_ms"]["p50"]
+        change = (p1 - p0) / p0 * 100 if p0 else 0
+        print("{0:<12} {1:>10.2f} {2:>10.2f} {3:>+7.1f}% {4:>10.1f} {5:>10.1f}".format(name,p0,p1,change,a["evals_per_frame"],b["evals_per_frame"]))
+
+def report(results):
+    print("import {0:.1f} ms, init {1:.1f} ms, bsp build {2:.2f} ms".format(results["import_ms"],results["init_ms"],results["build_ms"]))
+    print("{0:<12} {1:>6} {2:>8} {3:>8} {4:>8} {5:>8} {6:>10} {7:>10} {8:>10}".format(
+        "trace","frames","p50 ms","p90 ms","p99 ms","evals/f","traverse","project","raster"))
+    for name in sorted(results["traces"]):
+        r = results["traces"][name]
+        print("{0:<12} {1:>6} {2:>8.2f} {3:>8.2f} {4:>8.2f} {5:>8.1f} {6:>10.1f} {7:>10.1f} {8:>10.1f}".format(
+            name,r["frames"],r["frame_ms"]["p50"],r["frame_ms"]["p90"],r["frame_ms"]["p99"],r["evals_per_frame"],
+            r["stage_ms"]["traversal"],r["stage_ms"]["projection"],r["stage_ms"]["rasterisation"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("traces",nargs="*",help="trace files, default traces/*.txt")
+    parser.add_argument("--json",help="write the results here as JSON, - for stdout")
+    parser.add_argument("--compare",help="JSON from an earlier run to compare against")
+    parser.add_argument("--pixels",action="store_true",help="use the per-pixel path instead of strips")
+    parser.add_argument("--scale",type=int,default=1,help="draw every scale'th column, see FrameBudget")
+    parser.add_argument("--rows",action="store_true",help="scale rows as well as columns")
+    parser.add_argument("--scalar",action="store_true",help="project walls one at a time instead of the whole map with NumPy")
+    parser.add_argument("--no-shading",action="store_true",help="plain atlas textures without distance shading")
+    parser.add_argument("--textures",default="textures",help="directory with the texture files")
+    args = parser.parse_args(argv)
+
+    t = time.perf_counter()
+    import doom
+    import_ms = (time.perf_counter() - t) * 1000
+    t = time.perf_counter()
+    doom = load_doom()
+    init_ms = (time.perf_counter() - t) * 1000
+    doom.backend.texture_dir = args.textures
+    doom.cam.spans = not args.pixels
+    doom.cam.shading = not args.no_shading
+    if args.scalar:
+        doom.cam.batch = None
+    doom.cam.xscale = args.scale
+    doom.cam.yscale = args.scale if args.rows else 1
+    paths = args.traces or sorted(glob.glob(os.path.join(TRACE_DIR,"*.txt")))
+    results = {"spans": doom.cam.spans, "shading": doom.cam.shading, "batch": doom.cam.batch is not None, "xscale": doom.cam.xscale, "yscale": doom.cam.yscale, "walls": len(doom.level),
+               "import_ms": import_ms, "init_ms": init_ms, "build_ms": time_build(doom), "traces": {}}
+    probe = Probe(doom)
+    doom.profiler.enable()
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        results["traces"][name] = run_trace(doom,probe,path)
+
+    if args.json == "-":
+        json.dump(results,sys.stdout,indent=1,sort_keys=True)
+        print()
+    else:
+        report(results)
+        if args.json:
+            f = open(args.json,"w")
+            json.dump(results,f,indent=1,sort_keys=True)
+            f.close()
+    if args.compare:
+        f = open(args.compare)
+        old = json.load(f)
+        f.close()
+        compare(old,results)
+
+if __name__ == "__main__":
+    main()
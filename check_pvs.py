@@ -0,0 +1,86 @@
+"""Renders poses near walls with and without the PVS and compares the frames. The PVS may only ever hide what
+isn't visible anyway, so every frame has to come out the same.
+
+    python check_pvs.py                  # 600 poses
+    python check_pvs.py --poses 2000 --seed 3
+
+Poses are picked among the spots the player can actually get to: a flood fill from the spawn point over a grid,
+stepping only between spots Blockmap.blocked lets the player stand on, then kept if they're within --near of a wall.
+"""
+import argparse
+import random
+import sys
+
+from render_headless import load_doom
+
+# seen hiding a wall in columns 74-75 with the old point sampled PVS
+KNOWN_POSES = [(0.5072,-10.1681,27.94)]
+
+def reachable(doom,step=0.25):
+    """Every grid spot of step reachable from the player's position without walking through a wall."""
+    radius = doom.PLAYERRADIUS
+    start = (round(doom.plr.x / step),round(doom.plr.y / step))
+    seen = set([start])
+    stack = [start]
+    while stack:
+        i, j = stack.pop()
+        for key in ((i+1,j),(i-1,j),(i,j+1),(i,j-1)):
+            if key in seen or doom.blockmap.blocked(key[0] * step,key[1] * step,radius):
+                continue
+            seen.add(key)
+            stack.append(key)
+    return [(i * step,j * step) for i,j in sorted(seen)]
+
+def near_walls(doom,spots,near,step):
+    """Poses jittered around spots, kept if the nearest wall is further than the player radius but within near."""
+    radius = doom.PLAYERRADIUS
+    poses = []
+    for x,y in spots:
+        x += random.uniform(-step / 2,step / 2)
+        y += random.uniform(-step / 2,step / 2)
+        if doom.blockmap.blocked(x,y,radius) or not doom.blockmap.walls_near(x,y,near):
+            continue
+        poses.append((x,y,random.uniform(0,360)))
+    return poses
+
+def frame(doom,pvs,x,y,r):
+    doom.pvs = pvs
+    doom.plr.x = x
+    doom.plr.y = y
+    doom.plr.r = r * doom.RAD_CONST
+    doom.render_frame()
+    return doom.backend.grobs[1].copy()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--poses",type=int,default=600,help="how many random poses to try")
+    parser.add_argument("--near",type=float,default=1.0,help="only poses at most this far from a wall")
+    parser.add_argument("--seed",type=int,default=1)
+    args = parser.parse_args(argv)
+
+    doom = load_doom()
+    pvs = doom.pvs
+    if pvs is None:
+        print("no PVS in the level, nothing to check")
+        return 1
+    random.seed(args.seed)
+    step = 0.25
+    spots = reachable(doom,step)
+    poses = near_walls(doom,spots,args.near,step)
+    random.shuffle(poses)
+    poses = KNOWN_POSES + poses[:args.poses]
+    bad = 0
+    for x,y,r in poses:
+        a = frame(doom,pvs,x,y,r)
+        b = frame(doom,None,x,y,r)
+        diff = (a != b)
+        if diff.any():
+            bad += 1
+            columns = sorted(set(diff.nonzero()[1].tolist()))
+            print("pose {0:.4f} {1:.4f} {2:.2f}: {3} pixels differ in columns {4}..{5}".format(x,y,r,int(diff.sum()),columns[0],columns[-1]))
+    doom.pvs = pvs
+    print("{0} of {1} poses differ with the PVS ({2} reachable spots)".format(bad,len(poses),len(spots)))
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,580 +1,408 @@
-#PYTHON Doom
-import hpprime
-import graphic
-import math
-
-SCREEN_WIDTH = 320
-SCREEN_HEIGHT = 240
-EPSILON = 1e-6
-RAD_CONST = math.pi / 180
-
-ceiling_clip = [0]*SCREEN_WIDTH
-floor_clip = [SCREEN_HEIGHT]*SCREEN_WIDTH
-
-class Color:
-    """A color. Uses RGB because it's actually humanly readable and someone did in fact write this code themselves."""
-    def __init__(self,r,g,b):
-        self.R = r
-        self.G = g
-        self.B = b
-
-class Texture:
-    """Texture file"""
-    def __init__(self,fileno):
-        self.fileno = fileno
-    def load_file(self,surface=9):
-        #print("G{0} := AFiles('{1}');".format(str(surface),self.fileno))
-        hpprime.eval('G{0} := AFiles("{1}");'.format(str(surface),self.fileno))
-
-class TextureTree:
-    """Sorta like camera class but for textures."""
-    def __init__(self,surface=9):
-        self.tree = {}
-        self.loaded = "nil"
-        self.surface = surface
-
-    def add_texture(self,fileno):
-        self.tree[fileno] = Texture(fileno)
-
-    def load_texture(self,fileno,surface):
-        self.loaded = fileno
-        self.tree[fileno].load_file(surface)
-    def load_texture(self,fileno):
-        self.loaded = fileno
-        self.tree[fileno].load_file(self.surface)
-
-    def find_texcolumn(self,sx,x0,x1,w=128):
-        t = (sx - x0) / (x1 - x0)
-        return int(t * w) % w
-    
-    def find_texrow(self,sx,sy,x0,x1,y0up,y0down,y1up,y1down,h=128):
-        t = (sx-x0) / (x1-x0)
-        y0 = y0up + t * (y1up - y0up)
-        y1 = y0down + t * (y1down - y0down)
-        v = (sy - y0) / (y1-y0)
-        v = min(0,min(1,v))
-        return int(v*h) % h
-    
-    def find_texpix(self,sx,sy,x0,x1,y0up,y0down,y1up,y1down,w=128,h=128):
-        return self.find_texcolumn(sx,x0,x1,w), self.find_texrow(sx,sy,x0,x1,y0up,y0down,y1up,y1down,h)
-    
+"""Doom for the HP Prime. This is the game itself: BSP traversal, the frame loop, the profiler and frame pacing, on top of
+doom_render (backends), doom_textures, doom_camera and doom_map. It re-exports all of those so tools can keep saying doom.Wall.
 
-    def get_texture_pixel(self,fileno,x,y):
-        if self.loaded != fileno:
-            self.load_texture(fileno)
-        return "GETPIX_P(G9,{0},{1})".format(str(x),str(y))
-        # print("E"+col)
-       # return graphic.get_pixel(9,x%128,y%128) #col = str(this)
-        #if len(col) < 9:
-        col += "0"*(9-len(col))
-        rr = int(col[0:3])
-        gg = int(col[3:6])
-        bb = int(col[6:9])
-        try:
-            return Color(rr,gg,bb)
-        except ValueError:
-            print("!")
-            return Color(0,0,0)
-
-
-
-class Camera:
-    """Camera settings, pretty much. Contains projection and drawing functions."""
-    def __init__(self,FOV=75):
-        self.FOV = FOV*RAD_CONST
-    
-    def project_point(self,player,point,clip=True):
-        """Project a point using the player's perspective. Returns [a] the point's x position along the screen and [b] the point's perpendicular distance to the player."""
-        dX = point.x - player.x
-        dY = point.y - player.y
-
-        rX = (dX * math.cos(player.r)) - (dY * math.sin(player.r))
-        rY = (dX * math.sin(player.r)) + (dY * math.cos(player.r))
-
-        #if rY <= EPSILON:
-        #    return -9999, rY
-
-        focal_length = (SCREEN_WIDTH / 2) / math.tan(self.FOV / 2)
-        try:
-            x0 = (rX * focal_length) / rY + (SCREEN_WIDTH/2)
-        except ZeroDivisionError:
-            x0 = (rX * focal_length) / (rY-(1e-6)) + (SCREEN_WIDTH/2)
-
-        return x0, rY
-
-    def project_wall(self,player,wall,c=0):
-        """Project a wall using Camera.project_point. Returns [a,b] the x positions of the wall's start and end, [c,d] the top and bottom y positions of the wall's start, and [e,f] the top and bottom y positions of the wall's end."""
-
-        def inner(a,b):
-            if a == 0:
-                a -= EPSILON
-            if b == 0:
-                b -= EPSILON
-
-            r0 = (SCREEN_HEIGHT/2) + ((1 * SCREEN_HEIGHT) / (2 * a))
-            r1 = (SCREEN_HEIGHT/2) - ((1 * SCREEN_HEIGHT) / (2 * a))
-            r2 = (SCREEN_HEIGHT/2) + ((1 * SCREEN_HEIGHT) / (2 * b))
-            r3 = (SCREEN_HEIGHT/2) - ((1 * SCREEN_HEIGHT) / (2 * b))
-
-            return r0,r1,r2,r3
-
-        x0,y0 = self.project_point(player,wall.start)
-        x1,y1 = self.project_point(player,wall.end)
-        
-        if y0 <= EPSILON and y1 <= EPSILON: # Both points behind camera
-            return -10,0,0,0,0,0,0
-        
-        elif (y0 <= EPSILON or y1 <= EPSILON) and (c < 20): # One point behind camera, clipping wall is required
-
-            t = ((EPSILON) - y0) / (y1 - y0)
-            nX = wall.start.x + t * (wall.end.x - wall.start.x)
-            nY = wall.start.y + t * (wall.end.y - wall.start.y)
-
-            if y0 <= EPSILON:
-                x0,y0 = self.project_point(player,Linedef(Point(nX, nY), wall.end).start)
-                x1,y1 = self.project_point(player,Linedef(Point(nX, nY), wall.end).end)
-
-            elif y1 <= EPSILON:
-                x0,y0 = self.project_point(player,Linedef(wall.start, Point(nX, nY)).start)
-                x1,y1 = self.project_point(player,Linedef(wall.start, Point(nX, nY)).end)
-            
-            r0,r1,r2,r3 = inner(y0,y1)
-            return x0,x1,r0,r1,r2,r3,y0-y1
-            
+Importing it doesn't do any work. init() picks the backend and loads the level, run() is the game:
 
-        else:
-            r0,r1,r2,r3 = inner(y0,y1)
-            return x0,x1,r0,r1,r2,r3,y0-y1
-
-    def draw_quad(self,x0,y0,x1,y1,x2,y2,x3,y3,color:Color):
-        """Draws a quadrilateral. Included so that this code is more easily adaptable to other platforms."""
-        hpprime.eval( "FILLPOLY_P(G1,{0}({1},{2}),({3},{4}),({5},{6}),({7},{8}){9},RGB({10},{11},{12}))".format("{",round(x0),round(y0),round(x1),round(y1),round(x2),round(y2),round(x3),round(y3),"}",color.R,color.G,color.B))
-    
-    def draw_pix(self,x0,y0,color):
-        """Sets a pixel at x0,y0 to color Color. Included so that this code is more easily adaptable to other platforms. TBH this shouldn't even be that hard to implement anyways, but you're welcome."""
-        if type(color) == type(Color(255,255,255)): 
-            hpprime.eval( "PIXON_P(G1,{0},{1},RGB({2},{3},{4}))".format(str(x0),str(y0),str(color.R),str(color.G),str(color.B)))
-        else: 
-
-            hpprime.eval( "PIXON_P(G1,{0},{1},{2})".format(str(x0),str(y0),str(color)))
-    
-    def draw_wall(self,player,wall,color,ttree,fileno):
-        """Draws a wall in color Color. ON THE SCREEN. NO WAY!!!!"""
-        x0,x1,r0,r1,r2,r3,yd = self.project_wall(player,wall)
-        if (x0,x1,r0,r1,r2,r3) == (-10,0,0,0,0,0):
-            return -1
-        #self.draw_quad(x0,r0,x0,r1,x1,r3,x1,r2,color)
-        self.draw_textured_quad(ttree,fileno,x0,x1,r0,r1,r2,r3)
-
-    def draw_textured_quad(self,ttree:TextureTree,fileno,x0,x1,r0,r1,r2,r3):
-        inverse = False
-        rr0 = r2-r0
-        rr1 = r3-r1
-        if x0 == x1: return
-        if x0 > x1: 
-            x0, x1 = x1, x0
-            inverse = True
-        for i in range(max(int(x0),0),min(int(x1+1),SCREEN_WIDTH)):
-            if i > SCREEN_WIDTH or i < 0: continue
-            t = (i-x0) / (x1-x0)
-            t = min(1.0,max(0.0,t))
-            px = (t*128) % 128
-            y0 = r0 + t * rr0
-            y1 = r1 + t * rr1
-            if y1 - y0 == 0:
-                continue
-            if y0 > y1:
-                y0,y1 = y1,y0
-            for j in range(max(int(y0),0),min(int(y1+1),SCREEN_WIDTH)):
-                v = (j-y0) / (y1-y0)
-                if inverse:
-                    v = 1-v
-                py = int(v*128) % 128
-                col = ttree.get_texture_pixel(fileno, px, py )
-                self.draw_pix(i,j,col)
-                
-
-
-class Player:
-    def __init__(self,x,y,r):
-        self.x = x
-        self.y = y 
-        self.r = r
-
-class Point:
-    """2D coordinate with x/y values."""
-    def __init__(self,x,y):
-        self.x = x
-        self.y = y
-
-class Wall:
-    """Generic wall object lol"""
-    def __init__(self,start,end):
-        self.start = start
-        self.end = end
-        if type(start) == type(()) or type(start) == type([]): self.start = Point(start[0], start[1])
-        if type(end) == type(()) or type(end) == type([]): self.end = Point(end[0], end[1])
-        self.dx = self.end.x - self.start.x
-        self.dy = self.end.y - self.start.y
-
-Linedef = Wall
-
-class BSPNode:
-    """BSP tree node obviously"""
-    def __init__(self,partition,left=None,right=None,segments=[]):
-        self.partition = partition
-        self.left = left
-        self.right = right
-        self.segments = segments
+    import doom
+    doom.run()
 
+which is all main.py does on the calculator.
 """
-walls = [
-    Wall(Point(2, 18), Point(5, 8)),
-    Wall(Point(4, 2), Point(12, 5)),
-    Wall(Point(15, 5), Point(10, 10)),
-    Wall(Point(5, 8), Point(4, 2)),
-    Wall(Point(12, 5), Point(15, 5)),
-    Wall(Point(10, 10), Point(2, 18)),
-    Wall(Point(8, 12), Point(6, 12)),
-    Wall(Point(5, 6), Point(7, 6)),
-    ]
-"""
-walls = [
-  Wall(Point(-5, -5), Point(-3, -5)),
-  Wall(Point(-5, -5), Point(-5, -2)),
-  Wall(Point(5, -5), Point(3, -5)),
-  Wall(Point(5, -5), Point(5, -2)),
-  Wall(Point(5, 5), Point(3, 5)),
-  Wall(Point(5, 5), Point(5, 3)),
-  Wall(Point(-5, 3), Point(-5, 5)),
-  Wall(Point(-5, 5), Point(-3, 5)),
-  Wall(Point(5, 3), Point(10, 3)),
-  Wall(Point(5, -2), Point(10, -2)),
-  Wall(Point(3, 5), Point(3, 8)),
-  Wall(Point(-3, 5), Point(-3, 9)),
-  Wall(Point(-3, 9), Point(3, 8)),
-  Wall(Point(-5, 3), Point(-10, 3)),
-  Wall(Point(-10, -1), Point(-5, -2)),
-  Wall(Point(-10, 0), Point(-15, 2)),
-  Wall(Point(-10, 0), Point(-10, -1)),
-  Wall(Point(-10, 3), Point(-12, 6)),
-  Wall(Point(-15, 2), Point(-12, 6)),
-  Wall(Point(3, -5), Point(3, -10)),
-  Wall(Point(3, -10), Point(10, -10)),
-  Wall(Point(10, -10), Point(10, -2)),
-  Wall(Point(15, 3), Point(15, -5)),
-  Wall(Point(-5, -10), Point(0, -9)),
-  Wall(Point(0, -9), Point(0, -12)),
-  Wall(Point(0, -12), Point(5, -12)),
-  Wall(Point(-8, -10), Point(-8, -5)),
-  Wall(Point(-5, -12), Point(-8, -5)),
-  Wall(Point(-6, -10), Point(-5, -10)),
-  Wall(Point(13, -5), Point(13, -10)),
-  Wall(Point(15, -6), Point(16, -6)),
-  Wall(Point(16, 3), Point(16, -6)),
-  Wall(Point(-7, -8), Point(-6, -8)),
-  Wall(Point(-6, -8), Point(-3, -9)),
-  Wall(Point(-3, -9), Point(-4, -10)),
-  Wall(Point(-3, 4), Point(-3, 3)),
-  Wall(Point(-3, 3), Point(-2, 3)),
-  Wall(Point(-2, 3), Point(-2, 4)),
-  Wall(Point(-2, 4), Point(-3, 4)),
-  Wall(Point(10, 5), Point(10, 4)),
-  Wall(Point(10, 5), Point(15, 5)),
-  Wall(Point(10, 4), Point(5, 4)),
-  Wall(Point(-8, -5), Point(-10, -5)),
-  Wall(Point(-15, -1), Point(-13, -5)),
-  Wall(Point(-12, 1), Point(-12, -1)),
-  Wall(Point(-12, -1), Point(-10, -1)),
-  Wall(Point(-13, -5), Point(-13, -10)),
-  Wall(Point(-10, -5), Point(-10, -10)),
-  Wall(Point(-10, -10), Point(-5, -12)),
-  Wall(Point(-4, -10), Point(-4, -12)),
-  Wall(Point(-4, -12), Point(-2, -12)),
-  Wall(Point(-2, -12), Point(-2, -9)),
-  Wall(Point(-3, -9), Point(0, -9)),
-  Wall(Point(-13, -12), Point(-13, -15)),
-  Wall(Point(-13, -15), Point(-5, -15)),
-  Wall(Point(0, -15), Point(5, -15)),
-  Wall(Point(10, -15), Point(15, -15)),
-  Wall(Point(-15, -15), Point(-13, -12)),
-  Wall(Point(-15, 0), Point(-20, -5)),
-  Wall(Point(-15, 0), Point(-15, -1)),
-  Wall(Point(-20, -5), Point(-15, -15)),
-  Wall(Point(-17, -4), Point(-17, -3)),
-  Wall(Point(-17, -3), Point(-16, -3)),
-  Wall(Point(-16, -3), Point(-16, -4)),
-  Wall(Point(-16, -4), Point(-17, -4)),
-  Wall(Point(-17, -7), Point(-17, -8)),
-  Wall(Point(-17, -8), Point(-16, -8)),
-  Wall(Point(-16, -8), Point(-16, -7)),
-  Wall(Point(-16, -7), Point(-17, -7)),
-  Wall(Point(-16, -13), Point(-16, -12)),
-  Wall(Point(-16, -12), Point(-14, -12)),
-  Wall(Point(-14, -12), Point(-14, -13)),
-  Wall(Point(-14, -13), Point(-16, -13)),
-  Wall(Point(-9, -3), Point(-9, -3)),
-  Wall(Point(-9, -3), Point(-9, -2)),
-  Wall(Point(-9, -2), Point(-8, -2)),
-  Wall(Point(-8, -2), Point(-8, -3)),
-  Wall(Point(-8, -3), Point(-9, -3)),
-  Wall(Point(-9, -14), Point(-9, -13)),
-  Wall(Point(-9, -13), Point(-8, -13)),
-  Wall(Point(-8, -13), Point(-8, -14)),
-  Wall(Point(-8, -14), Point(-9, -14)),
-  Wall(Point(2, 4), Point(2, 2)),
-  Wall(Point(2, 3), Point(3, 3)),
-  Wall(Point(3, 3), Point(3, 4)),
-  Wall(Point(3, 4), Point(2, 4)),
-  Wall(Point(2, 2), Point(3, 3)),
-  Wall(Point(1, -13), Point(1, -14)),
-  Wall(Point(1, -14), Point(2, -14)),
-  Wall(Point(2, -14), Point(2, -13)),
-  Wall(Point(2, -13), Point(1, -13)),
-  Wall(Point(-5, -15), Point(-5, -17)),
-  Wall(Point(0, -15), Point(0, -17)),
-  Wall(Point(5, -15), Point(5, -16)),
-  Wall(Point(10, -15), Point(10, -17)),
-  Wall(Point(5, -16), Point(5, -17)),
-  Wall(Point(15, -15), Point(15, -17)),
-  Wall(Point(-5, -17), Point(15, -17)),
-  Wall(Point(13, -10), Point(15, -6)),
-  Wall(Point(15, 5), Point(15, 3)),
-  Wall(Point(15, 3), Point(16, 3)),
-  Wall(Point(15, -10), Point(15, -15)),
-  Wall(Point(15, -10), Point(16, -10)),
-  Wall(Point(16, -10), Point(16, -6)),
-  Wall(Point(13, -5), Point(14, -5)),
-  Wall(Point(14, -5), Point(14, -6)),
-  Wall(Point(14, -6), Point(13, -6)),
-  Wall(Point(12, 4), Point(11, 3)),
-  Wall(Point(11, 3), Point(12, 3)),
-  Wall(Point(12, 3), Point(12, 4)),
-  Wall(Point(7, -11), Point(7, -12)),
-  Wall(Point(7, -12), Point(8, -12)),
-  Wall(Point(8, -12), Point(8, -11)),
-  Wall(Point(8, -11), Point(7, -11)),
-  Wall(Point(-1, -3), Point(-1, -4)),
-  Wall(Point(-1, -4), Point(0, -4)),
-  Wall(Point(0, -4), Point(0, -3)),
-  Wall(Point(0, -3), Point(-1, -3)),
-  Wall(Point(-15, 2), Point(-15, 0)),
-  Wall(Point(5, 0), Point(7, 0)),
-  Wall(Point(7, 0), Point(7, -2)),
-  Wall(Point(-3, -5), Point(-3, -7)),
-  Wall(Point(-5, -7), Point(-3, -7)),
-  Wall(Point(-5, -7), Point(-5, -6)),
-  Wall(Point(-2, -12), Point(-1, -12)),
-  Wall(Point(1, -10), Point(3, -10)),
-  Wall(Point(3, -10), Point(3, -11)),
-  Wall(Point(3, -11), Point(4, -10)),
-  Wall(Point(3, -11), Point(1, -10)),
-  Wall(Point(5, 0), Point(5, -1)),
-  Wall(Point(-13, -12), Point(-13, -11)),
-  Wall(Point(-5, -15), Point(-5, -14)),
-  Wall(Point(-5, -12), Point(-5, -13)),
-  Wall(Point(5, -12), Point(5, -13)),
-  Wall(Point(5, -15), Point(5, -14)),
-  Wall(Point(0, -15), Point(0, -14)),
-  Wall(Point(0, -12), Point(0, -13)),
-  Wall(Point(-3, -5), Point(-2, -5)),
-  Wall(Point(3, -5), Point(2, -5)),
-  Wall(Point(-1, -5), Point(1, -5)),
-  Wall(Point(-5, 0), Point(-5, -2)),
-  Wall(Point(-5, 3), Point(-5, 2)),
-  Wall(Point(-10, 0), Point(-10, 2)),
-  Wall(Point(-8, -1), Point(-8, 1)),
-  Wall(Point(-8, 1), Point(-7, 1)),
-  Wall(Point(-7, 1), Point(-7, 0)),
-  Wall(Point(-8, -1), Point(-7, -1)),
-  Wall(Point(-8, -1), Point(-7, 0)),
-  Wall(Point(-7, -1), Point(-7, 0)),
-  Wall(Point(14, -10), Point(15, -10)),
-  Wall(Point(11, -10), Point(13, -10)),
-  Wall(Point(10, -15), Point(10, -12)),
-  Wall(Point(-5, -15), Point(-3, -15)),
-  Wall(Point(-2, -15), Point(0, -15)),
-  Wall(Point(5, -15), Point(6, -15)),
-  Wall(Point(7, -15), Point(10, -15)),
-  Wall(Point(11, 1), Point(11, -1)),
-  Wall(Point(11, -1), Point(12, -1)),
-  Wall(Point(12, -1), Point(12, 1)),
-  Wall(Point(12, 1), Point(11, 1)),
-]
-
-plr = Player(0,0,0)
-cam = Camera()
-
-def getdiv_linedef(case,partition):
-    try:
-        start = getdiv_point(case.start,partition.start,partition.dx,partition.dy) 
-        end = getdiv_point(case.end,partition.end,partition.dx,partition.dy) 
-    except Exception:
-        start = getdiv_point(case.start,partition.start,partition.end.x-partition.start.x,partition.end.y-partition.start.y)
-        end = getdiv_point(case.end,partition.end,partition.end.x-partition.start.x,partition.end.y-partition.start.y)
-    if start > 0 and end > 0:
-        return "back"
-    elif start < 0 and end < 0:
-        return "front"
-    elif start == 0 and end == 0:
-        return "on"
-    elif start == 0:
-        return "back" if end > 0 else "front"
-    elif end == 0:
-        return "front" if start > 0 else "back"
-    else:
-        return "span"
-
-def getdiv_point(case,partition,dx,dy):
-
-    # return table:
-    # div<0 = behind
-    #  div=0 = spanning
-    #  div>0 = in front
-    return ((case.x - partition.x) * dy) - ((case.y - partition.y) * dx)
-
-def splitdiv_linedef(case,partition):
-
-    dx = [case.start.x - case.end.x, partition.start.x - partition.end.x]
-    dy = [case.start.y - case.end.y, partition.start.y - partition.end.y]
-    def det(a,b): return a[0] * b[1] - a[1] * b[0]
-    div = det(dx,dy)
-    d = [det(*[[case.start.x,case.start.y],[case.end.x,case.end.y]]),det(*[[partition.start.x,partition.start.y],[partition.end.x,partition.end.y]])]
-    
-    if div < 1e-6: return ".","."
-
-    intersection_x = det(d, dx) / div
-    intersection_y = det(d, dy) / div
-
-    split_a = Linedef((case.start.x,case.start.y),(intersection_x,intersection_y))
-    split_b = Linedef((intersection_x,intersection_y),(case.end.x,case.end.y))
-
-    return split_a, split_b
-
-def find_partition(linedefs):
-    best = None
-    max_splits = 10000
-
-    for candidate in linedefs:
-        splits = 0
-
-        for test in linedefs:
-            if test == candidate: continue
-            if getdiv_linedef(test,candidate) == "span": splits += 1
-
-        if splits <= max_splits:
-            max_splits = splits
-            best = candidate
-            if splits == 0:
-                break
-
-    return best
-
-def build_bsp(linedefs):
-    if not linedefs:
-        return
-    
-    partition = find_partition(linedefs) #linedefs[0] # TEST CASE - THIS SHOULD BE REPLACED FOR OPTIMAL PERFORMANCE AND SIMPLICITY
-    front_division = []
-    back_division = []
-    on_division = []
-
-    for line in linedefs:
-        div = getdiv_linedef(line,partition)
-        if div=="back": back_division.append(line)
-        elif div=="front": front_division.append(line)
-        elif div=="on": on_division.append(line) # arbitary, could be back if u wanted ACTUALLY NVM
-        elif div=="span":
-            a,b = splitdiv_linedef(line,partition)
-            if (a,b) == (".","."):
-                continue
-            front_division.append(a)
-            back_division.append(b)
-    node = BSPNode(partition,
-        left=build_bsp(front_division),
-        right=build_bsp(back_division),
-        segments=on_division + [partition]
-                   )
-    
-    return node
-
-def render_bsp(node,player):
+import math
 
-    if not node:
+from doom_render import *
+from doom_textures import *
+from doom_map import *
+from doom_camera import *
+try: # MicroPython: millisecond ticks that wrap around, so differences go through ticks_diff
+    from time import ticks_ms as clock, ticks_diff
+    def elapsed(start):
+        """Seconds since start, a clock() reading."""
+        return ticks_diff(clock(),start) / 1000
+except ImportError:
+    try:
+        from time import perf_counter as clock
+        def elapsed(start):
+            return clock() - start
+    except ImportError: # time.time only has whole seconds on MicroPython, so no clock: the profiler only counts and frames get a fixed wait
+        clock = None
+
+WAD_FILE = "doom.wad" # levels, see make_wad.py
+LEVEL = "E1M1"
+CEILING_COLOR = 100255
+FLOOR_COLOR = 255100
+EVAL_REPORT = False # print per-pixel vs strip eval counts for the first frame
+TARGET_FPS = 15
+PROFILER_KEY = 9 # View
+PLAYERROTATIONSPEED = 2
+PLAYERSPEED = 0.1
+PLAYERRADIUS = 0.25
+
+# the game's state, all of it set up by init()
+HEADLESS = True
+backend = None
+plr = None
+cam = None
+tree = None
+frame_cache = None
+profiler = None
+frame_budget = None
+bsp_builder = None
+bsp_map = None
+bsp_hash = 0
+level = []
+pvs = None
+blockmap = None
+profiler_key = False # was the toggle key down last frame
+
+def render_bsp(m,player):
+    """Front to back: the player's side of each partition first, so the clipper can hide what's behind. Stops once every column is solid.
+    Runs off an explicit stack of node numbers, ~n on the stack meaning "draw node n's own walls"."""
+    if m is None:
         return
+    x = player.x
+    y = player.y
+    clipper = cam.clipper
+    stack = [0]
+    while stack:
+        n = stack.pop()
+        if n < 0:
+            n = ~n
+            draw_wrapper(m,m.first[n],m.count[n])
+            continue
+        if clipper.full():
+            return
+        cam.nodes += 1
+        if pvs is not None and not pvs.visible(n):
+            cam.hidden += 1
+            continue
+        if not cam.box_visible(m.box,4*n):
+            cam.culled += 1
+            continue
+        if not cam.shading: # the textures of this node's own walls, shaded walls come out of the column cache, not the atlas
+            for k in range(m.tex_first[n],m.tex_first[n] + m.tex_count[n]):
+                if not tree.prefetch_texture(m.textures[m.texrefs[k]]):
+                    break
+        if m.a[n] * x + m.b[n] * y + m.c[n] < 0: # in front, left child first
+            near = m.left[n]
+            far = m.right[n]
+        else: # behind or on it
+            near = m.right[n]
+            far = m.left[n]
+        if far >= 0:
+            stack.append(far)
+        stack.append(~n)
+        if near >= 0:
+            stack.append(near)
+
+
+def draw_wrapper(m,first,count):
+    for i in range(first,first+count):
+        seg = m.segs[i]
+        cam.draw_wall(plr,seg,tree,seg.texture,i)
     
-    mid = ((node.partition.start.x + node.partition.end.x) / 2, (node.partition.start.y + node.partition.end.y) / 2)
-    div = getdiv_linedef(Linedef((player.x,player.y),mid),node.partition)
-    if div == "front" or div == "span" or div == "on": # front / span / on
-        render_bsp(node.left,player)
-        draw_wrapper(node.segments)
-        render_bsp(node.right,player)
-    elif div == "back": # behind
-        render_bsp(node.right,player)
-        draw_wrapper(node.segments)
-        render_bsp(node.left,player)
-
-
-tree = TextureTree()
-
-tree.add_texture("brick.jpg")
-
-def draw_wrapper(seg):
-    for i in seg:
-        cam.draw_wall(plr,i,Color(255,255,255),tree,"brick.jpg")
-    
-bsp_tree = build_bsp(walls)
-del walls
-render_bsp(bsp_tree,plr)
-
-
-PLAYERROTATIONSPEED = 2
-while True:
-    hpprime.eval("WAIT(0.015)")
-
-    hpprime.fillrect(1,0,0,320,120,0,100255)
-    hpprime.fillrect(1,0,120,320,120,0,255100)
-
-    ceiling_clip = [0]*SCREEN_WIDTH
-    floor_clip = [SCREEN_HEIGHT]*SCREEN_WIDTH
+def count_frame_evals(spans=True):
+    """Renders one frame and returns how many evals it issued. Compare count_frame_evals(False) and count_frame_evals(True) for before/after of the strip renderer."""
+    old = cam.spans
+    cam.spans = spans
+    start = backend.evals
+    cam.begin_frame(plr)
+    if pvs is not None:
+        pvs.begin_frame(plr)
+    render_bsp(bsp_map,plr)
+    cam.spans = old
+    return backend.evals - start
+
+def render_frame():
+    """Walls and then the ceiling and floor around them into G1. Presenting it is up to the caller."""
+    tree.new_frame()
+    cam.begin_frame(plr)
+    if pvs is not None:
+        pvs.begin_frame(plr)
+    render_bsp(bsp_map,plr)
+    cam.draw_planes(CEILING_COLOR,FLOOR_COLOR)
+
+class FrameCache:
+    """Remembers what the frame in G1 was drawn from so an unchanged view is just blitted again instead of redrawn.
+    G1 is never touched between frames, it already holds the finished frame with the crosshair inverted on top."""
+    def __init__(self):
+        self.key = None
+        self.rendered = 0
+        self.reused = 0
+
+    def fresh(self,key):
+        """True if key differs from the last frame's, meaning the caller has to draw a new one."""
+        if key == self.key:
+            self.reused += 1
+            return False
+        self.key = key
+        self.rendered += 1
+        return True
+
+    def invalidate(self):
+        self.key = None
+
+    def stats(self):
+        return {"rendered": self.rendered, "reused": self.reused}
+
+class Profiler:
+    """Per-frame counters and stage timings for finding out why a frame is slow. enable() wraps the camera and backend
+    methods it needs on the instances, disable() takes the wrappers off again, so while it's off nothing is hooked in at all.
+    last holds the counts for the last frame drawn, total adds up every frame since reset()."""
+    COUNTERS = ("nodes","culled","hidden","walls","behind","textured","flat","columns","pixels","planes","loads","evals")
+    STAGES = ("frame","projection","rasterisation")
+    def __init__(self,timing=True):
+        self.on = False
+        self.overlay = False
+        self.timing = timing and clock is not None
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.last = {}
+        self.total = dict((name,0) for name in self.COUNTERS + self.STAGES)
+        self.current = dict((name,0) for name in self.COUNTERS + self.STAGES)
+
+    def hook(self,obj,name,func):
+        original = getattr(obj,name)
+        setattr(obj,name,lambda *args: func(original,*args))
+        self.hooked.append((obj,name))
+
+    def timed(self,stage):
+        def run(original,*args):
+            t = clock()
+            original(*args)
+            self.current[stage] += elapsed(t)
+        return run
+
+    def enable(self,c=None,b=None):
+        if self.on: return
+        c = c or cam
+        b = b or backend
+        self.cam = c
+        self.backend = b
+        self.hooked = []
+        def project(original,player,wall,*args):
+            current = self.current
+            current["walls"] += 1
+            if self.timing:
+                t = clock()
+                result = original(player,wall,*args)
+                current["projection"] += elapsed(t)
+            else:
+                result = original(player,wall,*args)
+            if result[:6] == (-10,0,0,0,0,0): # project_wall's behind-the-camera sentinel, as draw_wall checks it
+                current["behind"] += 1
+            return result
+        def strip(original,x,y0,y1,slot,px,*args):
+            self.current["pixels"] += max(0,min(int(y1),SCREEN_HEIGHT-1) - max(int(y0),0) + 1)
+            original(x,y0,y1,slot,px,*args)
+        def pix(original,*args):
+            self.current["pixels"] += 1
+            original(*args)
+        self.hook(c,"project_wall",project)
+        self.hook(c,"draw_strip",strip)
+        self.hook(c,"draw_pix",pix)
+        if self.timing:
+            self.hook(c,"draw_textured_quad",self.timed("rasterisation"))
+            self.hook(c,"draw_flat",self.timed("rasterisation"))
+            self.hook(c,"draw_planes",self.timed("rasterisation")) # the floor and ceiling spans
+            if c.batch is not None: # the whole map gets projected up front, project_wall only looks the results up
+                self.hook(c.batch,"begin_frame",self.timed("projection"))
+        self.on = True
+
+    def disable(self):
+        if not self.on: return
+        for obj, name in self.hooked:
+            delattr(obj,name)
+        self.on = False
+        self.overlay = False
+
+    def begin_frame(self):
+        for name in self.current:
+            self.current[name] = 0
+        self.evals = self.backend.evals
+        self.ttree = tree
+        self.loads = tree.misses + tree.prefetches + tree.decodings
+        if self.timing:
+            self.start = clock()
+
+    def end_frame(self):
+        current = self.current
+        if self.timing:
+            current["frame"] = elapsed(self.start)
+        current["nodes"] = self.cam.nodes
+        current["culled"] = self.cam.culled
+        current["hidden"] = self.cam.hidden
+        current["textured"] = self.cam.textured
+        current["flat"] = self.cam.flat
+        current["columns"] = self.cam.clipper.columns
+        current["planes"] = self.cam.planes
+        current["pixels"] += self.cam.filled # strips and single pixels got counted as they went
+        current["loads"] = self.ttree.misses + self.ttree.prefetches + self.ttree.decodings - self.loads
+        current["evals"] = self.backend.evals - self.evals
+        self.frames += 1
+        for name in current:
+            self.total[name] += current[name]
+        self.last = dict(current)
+
+    def lines(self):
+        """The overlay text, times in ms."""
+        f = self.last
+        if not f: return []
+        lines = ["nodes {0} culled {1} pvs {2}".format(f["nodes"],f["culled"],f["hidden"]),
+                 "walls {0} behind {1}".format(f["walls"],f["behind"]),
+                 "textured {0} flat {1} spans {2}".format(f["textured"],f["flat"],f["planes"]),
+                 "cols {0} px {1} loads {2} evals {3}".format(f["columns"],f["pixels"],f["loads"],f["evals"])]
+        if self.timing:
+            lines.append("ms {0:.1f} proj {1:.1f} rast {2:.1f}".format(f["frame"]*1000,f["projection"]*1000,f["rasterisation"]*1000))
+        return lines
+
+    def draw(self):
+        """Overlay in the top left of the screen. Goes straight onto G0 after the blit so it's never scaled and never ends up in the cached frame."""
+        y = 0
+        for line in self.lines():
+            self.backend.text(0,0,y,line,0xFFFFFF,0)
+            y += 11
+
+class FrameBudget:
+    """Frame pacing plus dynamic resolution. Keeps a moving average of how long the last few drawn frames took and picks
+    cam.xscale (and yscale too with rows=True) from scales so the average fits in 1/target_fps, then sleeps off whatever's
+    left of the frame instead of a fixed WAIT."""
+    def __init__(self,target_fps=15,scales=(1,2,4),rows=False,window=8):
+        self.target = 1 / target_fps
+        self.scales = scales
+        self.rows = rows
+        self.window = window
+        self.times = []
+        self.level = 0 # index into scales
+        self.start = 0
+        self.rendered = frame_cache.rendered
+
+    def begin(self):
+        if clock is not None:
+            self.start = clock()
+
+    def end(self,c=None):
+        """Call after the frame is presented. Reused frames only get paced, they say nothing about how expensive drawing is."""
+        c = c or cam
+        if clock is None:
+            backend.wait(0.015)
+            return
+        spent = elapsed(self.start)
+        if frame_cache.rendered != self.rendered:
+            self.rendered = frame_cache.rendered
+            self.times.append(spent)
+            if len(self.times) > self.window:
+                self.times.pop(0)
+            self.pick(c)
+        if spent < self.target:
+            backend.wait(self.target - spent)
+
+    def average(self):
+        return sum(self.times) / len(self.times) if self.times else 0
+
+    def pick(self,c):
+        """Coarser when the average is over budget, finer again once it would still fit at the next scale up
+        (drawing cost is about proportional to the columns drawn)."""
+        avg = self.average()
+        level = self.level
+        if avg > self.target and level < len(self.scales)-1:
+            level += 1
+        elif level > 0 and avg * self.scales[level] / self.scales[level-1] < self.target * 0.8:
+            level -= 1
+        if level != self.level:
+            self.level = level
+            self.times = [] # the old times were for the other scale
+        c.xscale = self.scales[level]
+        c.yscale = self.scales[level] if self.rows else 1
+
+def frame_key():
+    """Everything the picture depends on that can change while playing."""
+    return (plr.x,plr.y,plr.r,cam.FOV,cam.spans,cam.shading,bsp_hash,cam.xscale,cam.yscale)
+
+def draw_crosshair():
+    x = SCREEN_WIDTH // 2 // cam.xscale
+    y = SCREEN_HEIGHT // 2 // cam.yscale
+    dx = 5 // cam.xscale
+    dy = 5 // cam.yscale
+    backend.invert(x-dx,y,x+dx,y)
+    backend.invert(x,y-dy,x,y+dy)
+    backend.invert(x,y,x,y)
+
+def game_frame():
+    """One pass of the game loop: draw (or reuse) the frame, apply the held keys, present. bench.py replays key traces through this."""
+    global profiler_key
+    if frame_cache.fresh(frame_key()):
+        if profiler.on:
+            profiler.begin_frame()
+            render_frame()
+            draw_crosshair()
+            profiler.end_frame()
+        else:
+            render_frame()
+            draw_crosshair()
 
-    render_bsp(bsp_tree,plr)
+    key = backend.key_down(PROFILER_KEY)
+    if key and not profiler_key:
+        if profiler.overlay:
+            profiler.disable()
+        else:
+            profiler.enable()
+            profiler.overlay = True
+        frame_cache.invalidate() # a still view wouldn't redraw, and the overlay needs a profiled frame to show
+    profiler_key = key
 
-    if hpprime.eval("ISKEYDOWN(7)"): #hpprime.keyboard() == 128: #2**7
+    if backend.key_down(7): #hpprime.keyboard() == 128: #2**7
         plr.r -= RAD_CONST*PLAYERROTATIONSPEED
-    elif hpprime.eval("ISKEYDOWN(8)"): #hpprime.keyboard() == 256: #2**8
+    elif backend.key_down(8): #hpprime.keyboard() == 256: #2**8
         plr.r += RAD_CONST*PLAYERROTATIONSPEED
-    if hpprime.eval("ISKEYDOWN(2)"): #hpprime.keyboard() == 4: #2**2
-        plr.x += math.sin(plr.r) * 0.1
-        plr.y += math.cos(plr.r) * 0.1
-        if 0 == 1:
-          plr.x -= math.sin(plr.r) * 0.1
-          plr.y -= math.cos(plr.r) * 0.1
-    elif hpprime.eval("ISKEYDOWN(12)"): #hpprime.keyboard() == 4096: #2**12
-        plr.x -= math.sin(plr.r) * 0.1
-        plr.y -= math.cos(plr.r) * 0.1
-        if 0 == 1:
-           plr.x += math.sin(plr.r) * 0.1
-           plr.y += math.cos(plr.r) * 0.1
+    if backend.key_down(2): #hpprime.keyboard() == 4: #2**2
+        blockmap.move(plr,math.sin(plr.r) * PLAYERSPEED,math.cos(plr.r) * PLAYERSPEED,PLAYERRADIUS)
+    elif backend.key_down(12): #hpprime.keyboard() == 4096: #2**12
+        blockmap.move(plr,-math.sin(plr.r) * PLAYERSPEED,-math.cos(plr.r) * PLAYERSPEED,PLAYERRADIUS)
     #hpprime.line(1,160,120,160-10*math.sin(plr.r*(math.pi/math.pi)),120-10*math.cos(plr.r*(math.pi/math.pi)),255255)
-    hpprime.eval("INVERT_P(G1,155,120,165,120)")
-    hpprime.eval("INVERT_P(G1,160,115,160,125)")
-    hpprime.eval("INVERT_P(G1,160,120,160,120)")
-    hpprime.blit(0,0,0,1)
-
-
-#END
-
-START()
-BEGIN
-DIMGROB_P(G1,320,240,#000000);
-DIMGROB_P(G2,512,512,#000000);
-DIMGROB_P(G3,512,512,#000000);
-DIMGROB_P(G4,512,512,#000000);
-DIMGROB_P(G5,512,512,#000000);
-DIMGROB_P(G6,512,512,#000000);
-DIMGROB_P(G7,512,512,#000000);
-DIMGROB_P(G8,512,512,#000000);
-DIMGROB_P(G9,128,128,#000000);
-PYTHON(Doom);
-END;
+    backend.blit(cam.xscale,cam.yscale)
+    if profiler.overlay:
+        profiler.draw()
+
+def init():
+    """Sets everything up: the backend (which makes the grobs on the calculator), camera, texture caches, the level and
+    its blockmap. run() does this, desktop tools call it themselves and then drive render_frame()/game_frame()."""
+    global HEADLESS, backend, plr, cam, tree, frame_cache, profiler, frame_budget
+    global bsp_builder, bsp_map, bsp_hash, level, pvs, blockmap, profiler_key
+    backend = make_backend()
+    HEADLESS = isinstance(backend,FramebufferBackend)
+    plr = Player(0,0,0)
+    cam = Camera(backend,ColumnCache(backend))
+    tree = TextureTree(backend)
+    frame_cache = FrameCache()
+    profiler = Profiler()
+    profiler_key = False
+    frame_budget = FrameBudget(TARGET_FPS)
+    bsp_builder = BSPBuilder()
+    bsp_map, bsp_hash, level, pvs = load_level(data_path(WAD_FILE),LEVEL,bsp_builder)
+    if bsp_map is not None:
+        cam.vx = bsp_map.vx
+        cam.vy = bsp_map.vy
+        if HEADLESS: # NumPy is there anyway, project the whole map at once
+            cam.batch = BatchProjection(bsp_map)
+    for wall in level:
+        if wall.texture not in tree.tree:
+            tree.add_texture(wall.texture)
+    blockmap = Blockmap(level)
+    if EVAL_REPORT:
+        print("evals per frame: per-pixel {0}, strips {1}".format(count_frame_evals(False),count_frame_evals(True)))
+
+def run(frames=None):
+    """init() and then the game loop, forever or for frames frames."""
+    init()
+    frame = 0
+    while frames is None or frame < frames:
+        frame_budget.begin()
+        game_frame()
+        frame_budget.end()
+        frame += 1
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,478 @@
+"""Player, Camera and ColumnClipper: projecting walls and drawing them into G1."""
+import math
+from array import array
+
+from doom_render import SCREEN_WIDTH, SCREEN_HEIGHT
+from doom_textures import LIGHT_BANDS, LIGHT_DISTANCE, TextureTree, band_light, shade_rgb
+from doom_map import EPSILON, RAD_CONST
+
+LOD_DEPTH = 12 # walls with no end nearer than this are drawn flat, see Camera.draw_wall
+LOD_WIDTH = 3 # so are walls this many columns wide or less
+LOD_MIN_LIGHT = 0.25 # darkest the distance shading on flat walls gets without cam.shading
+
+class BatchProjection:
+    """Camera.project_wall for every seg of a BSPMap at once, with NumPy, for the desktop where maps can have thousands of lines.
+    begin_frame() rotates and projects the whole vertex table in one go and near plane clips every seg with masks, so the
+    BSP walk only decides the order walls get rasterised in. Does the same sums in the same order as project_wall."""
+    def __init__(self,m):
+        import numpy
+        self.np = numpy
+        self.vx = numpy.array(m.vx,dtype=numpy.float64)
+        self.vy = numpy.array(m.vy,dtype=numpy.float64)
+        self.v0 = numpy.array(m.seg_v0,dtype=numpy.int64)
+        self.v1 = numpy.array(m.seg_v1,dtype=numpy.int64)
+        self.walls = [] # project_wall's tuple per seg for this frame
+
+    def screen_x(self,rX,rY,focal_length):
+        np = self.np
+        return rX * focal_length / np.where(rY == 0,rY - 1e-6,rY) + SCREEN_WIDTH/2
+
+    def begin_frame(self,cam):
+        np = self.np
+        dX = self.vx - cam.px
+        dY = self.vy - cam.py
+        rX = dX * cam.cos - dY * cam.sin
+        rY = dX * cam.sin + dY * cam.cos
+        sx = self.screen_x(rX,rY,cam.focal_length)
+        rX0 = rX[self.v0]
+        rX1 = rX[self.v1]
+        y0 = rY[self.v0]
+        y1 = rY[self.v1]
+        x0 = sx[self.v0]
+        x1 = sx[self.v1]
+        near0 = y0 <= EPSILON
+        near1 = y1 <= EPSILON
+        behind = near0 & near1
+        cut0 = near0 & ~behind
+        cut1 = near1 & ~behind & ~near0
+        cut = cut0 | cut1
+        with np.errstate(divide="ignore",invalid="ignore"):
+            t = np.where(cut,(EPSILON - y0) / np.where(cut,y1 - y0,1),0)
+        nx = self.screen_x(rX0 + t * (rX1 - rX0),EPSILON,cam.focal_length)
+        x0 = np.where(cut0,nx,x0)
+        x1 = np.where(cut1,nx,x1)
+        y0 = np.where(cut0,EPSILON,y0)
+        y1 = np.where(cut1,EPSILON,y1)
+        u0 = np.where(cut0,t,0.0)
+        u1 = np.where(cut1,t,1.0)
+        with np.errstate(divide="ignore"): # only the behind ones can be 0 and those get the sentinel
+            r0 = SCREEN_HEIGHT/2 + SCREEN_HEIGHT / (2 * y0)
+            r1 = SCREEN_HEIGHT/2 - SCREEN_HEIGHT / (2 * y0)
+            r2 = SCREEN_HEIGHT/2 + SCREEN_HEIGHT / (2 * y1)
+            r3 = SCREEN_HEIGHT/2 - SCREEN_HEIGHT / (2 * y1)
+        walls = list(zip(x0.tolist(),x1.tolist(),r0.tolist(),r1.tolist(),r2.tolist(),r3.tolist(),(y0 - y1).tolist(),u0.tolist(),u1.tolist()))
+        for i in np.flatnonzero(behind).tolist():
+            walls[i] = (-10,0,0,0,0,0,0,0,1)
+        self.walls = walls
+
+class ColumnClipper:
+    """Which screen columns already have a solid wall in them, kept as a sorted list of [first,last] ranges (the original engine's solidsegs).
+    Walls are drawn front to back so anything landing on a solid column is hidden."""
+    def __init__(self,width=SCREEN_WIDTH):
+        self.width = width
+        self.reset()
+
+    def reset(self):
+        self.solid = []
+        self.walls = 0 # walls that got at least one column this frame
+        self.columns = 0
+
+    def full(self):
+        return len(self.solid) == 1 and self.solid[0][0] <= 0 and self.solid[0][1] >= self.width-1
+
+    def clip(self,first,last):
+        """Returns the still open (first,last) ranges inside first..last and marks all of first..last solid."""
+        visible = []
+        x = first
+        for a,b in self.solid:
+            if b < x: continue
+            if a > last: break
+            if a > x: visible.append((x,a-1))
+            x = b+1
+            if x > last: break
+        if x <= last:
+            visible.append((x,last))
+        if visible:
+            self.walls += 1
+            for a,b in visible:
+                self.columns += b-a+1
+            self.add(first,last)
+        return visible
+
+    def add(self,first,last):
+        merged = []
+        for a,b in self.solid:
+            if b < first-1 or a > last+1:
+                merged.append((a,b))
+            else: # touching or overlapping, swallow it
+                first = min(first,a)
+                last = max(last,b)
+        merged.append((first,last))
+        merged.sort()
+        self.solid = merged
+
+class Camera:
+    """Camera settings, pretty much. Contains projection and drawing functions. Draws through backend, shaded columns come out of columns (a ColumnCache)."""
+    def __init__(self,backend,columns,FOV=75,spans=True):
+        self.backend = backend
+        self.columns = columns
+        self.FOV = FOV*RAD_CONST
+        self.spans = spans # False = old per-pixel path, one PIXON_P per pixel
+        self.focal_length = (SCREEN_WIDTH / 2) / math.tan(self.FOV / 2)
+        self.tan_half = math.tan(self.FOV / 2)
+        self.clipper = ColumnClipper()
+        self.vx = array("f") # shared vertex table of the map, see BSPMap
+        self.vy = array("f")
+        self.projected = []
+        self.nodes = 0 # BSP nodes visited last frame
+        self.culled = 0 # subtrees thrown out by box_visible
+        self.hidden = 0 # subtrees thrown out by the PVS
+        self.xscale = 1 # draw every xscale'th column / yscale'th row into the top left of G1, blit() stretches it back
+        self.yscale = 1
+        self.lod = True # far and tiny walls get flat shaded fillrects instead of texture strips
+        self.lod_depth = LOD_DEPTH
+        self.lod_width = LOD_WIDTH
+        self.textured = 0 # walls that went down each path last frame
+        self.flat = 0
+        self.planes = 0 # floor and ceiling spans drawn last frame
+        self.filled = 0 # pixels those spans and flat walls filled
+        self.ceiling_clip = [] # per column of the scaled frame, the wall pass covers rows ceiling_clip[x] to floor_clip[x]-1
+        self.floor_clip = []
+        self.shading = True # darken with distance through the light band colormaps and ColumnCache
+        self.batch = None # a BatchProjection for the map, then project_wall is a lookup into it
+        self.window = (0,SCREEN_WIDTH-1) # screen columns that get drawn. The clipper still covers the whole screen so a strip comes out exactly like that part of the full frame
+
+    def begin_frame(self,player):
+        """Per frame setup: the view transform, an empty vertex cache, the clipper and the counters."""
+        self.px = player.x
+        self.py = player.y
+        self.cos = math.cos(player.r)
+        self.sin = math.sin(player.r)
+        self.projected = [None]*len(self.vx)
+        if self.batch is not None:
+            self.batch.begin_frame(self)
+        self.clipper.reset()
+        self.nodes = 0
+        self.culled = 0
+        self.hidden = 0
+        self.textured = 0
+        self.flat = 0
+        self.planes = 0
+        self.filled = 0
+        half = SCREEN_HEIGHT // self.yscale // 2 # columns without a wall are half ceiling, half floor
+        self.ceiling_clip = [half] * (SCREEN_WIDTH // self.xscale)
+        self.floor_clip = [half] * (SCREEN_WIDTH // self.xscale)
+
+    def box_visible(self,box,i=0):
+        """False if the box (minx,miny,maxx,maxy) at box[i:i+4] is all behind the player or all past one edge of the FOV. Edges are planes through the eye so corners behind the player still count."""
+        behind = True
+        left = True
+        right = True
+        for x in (box[i],box[i+2]):
+            dX = x - self.px
+            for y in (box[i+1],box[i+3]):
+                dY = y - self.py
+                rX = (dX * self.cos) - (dY * self.sin)
+                rY = (dX * self.sin) + (dY * self.cos)
+                if rY > EPSILON: behind = False
+                if rX >= -rY * self.tan_half: left = False
+                if rX <= rY * self.tan_half: right = False
+        return not (behind or left or right)
+    
+    def project_point(self,player,point,clip=True):
+        """Project a point using the player's perspective. Returns [a] the point's x position along the screen and [b] the point's perpendicular distance to the player."""
+        dX = point.x - player.x
+        dY = point.y - player.y
+
+        rX = (dX * math.cos(player.r)) - (dY * math.sin(player.r))
+        rY = (dX * math.sin(player.r)) + (dY * math.cos(player.r))
+
+        #if rY <= EPSILON:
+        #    return -9999, rY
+
+        return self.screen_x(rX,rY), rY
+
+    def screen_x(self,rX,rY):
+        """Screen column of a point already in view space."""
+        try:
+            return (rX * self.focal_length) / rY + (SCREEN_WIDTH/2)
+        except ZeroDivisionError:
+            return (rX * self.focal_length) / (rY-(1e-6)) + (SCREEN_WIDTH/2)
+
+    def project_vertex(self,i):
+        """Vertex i of the vertex table through this frame's view transform, as (rX,rY,screen x). Each vertex gets done at most once a frame."""
+        p = self.projected[i]
+        if p is None:
+            dX = self.vx[i] - self.px
+            dY = self.vy[i] - self.py
+            rX = (dX * self.cos) - (dY * self.sin)
+            rY = (dX * self.sin) + (dY * self.cos)
+            p = (rX,rY,self.screen_x(rX,rY))
+            self.projected[i] = p
+        return p
+
+    def wall_heights(self,a,b):
+        """Top and bottom screen y of a wall at depths a and b."""
+        if a == 0:
+            a -= EPSILON
+        if b == 0:
+            b -= EPSILON
+
+        r0 = (SCREEN_HEIGHT/2) + ((1 * SCREEN_HEIGHT) / (2 * a))
+        r1 = (SCREEN_HEIGHT/2) - ((1 * SCREEN_HEIGHT) / (2 * a))
+        r2 = (SCREEN_HEIGHT/2) + ((1 * SCREEN_HEIGHT) / (2 * b))
+        r3 = (SCREEN_HEIGHT/2) - ((1 * SCREEN_HEIGHT) / (2 * b))
+
+        return r0,r1,r2,r3
+
+    def project_wall(self,player,wall,c=0,i=None):
+        """Project a wall using the frame's vertex cache. Returns [a,b] the x positions of the wall's start and end, [c,d] the top and bottom y positions of the wall's start, [e,f] the top and bottom y positions of the wall's end,
+        [g] the depth difference and [h,i] where along the wall (0-1) the start and end are, which is only not 0,1 when the near plane cut it.
+        Needs begin_frame for player first and the wall's v0/v1 indexing self.vx/self.vy. With a batch and the wall's seg number i it's already worked out."""
+        if i is not None and self.batch is not None:
+            return self.batch.walls[i]
+
+        rX0,y0,x0 = self.project_vertex(wall.v0)
+        rX1,y1,x1 = self.project_vertex(wall.v1)
+        
+        if y0 <= EPSILON and y1 <= EPSILON: # Both points behind camera
+            return -10,0,0,0,0,0,0,0,1
+        
+        elif (y0 <= EPSILON or y1 <= EPSILON) and (c < 20): # One point behind camera, clipping wall is required
+            # The rotation is linear so the cut can be done in view space, no new points needed
+            t = ((EPSILON) - y0) / (y1 - y0)
+            nX = rX0 + t * (rX1 - rX0)
+            u0 = 0
+            u1 = 1
+
+            if y0 <= EPSILON:
+                x0,y0 = self.screen_x(nX,EPSILON),EPSILON
+                u0 = t
+
+            elif y1 <= EPSILON:
+                x1,y1 = self.screen_x(nX,EPSILON),EPSILON
+                u1 = t
+            
+            r0,r1,r2,r3 = self.wall_heights(y0,y1)
+            return x0,x1,r0,r1,r2,r3,y0-y1,u0,u1
+            
+
+        else:
+            r0,r1,r2,r3 = self.wall_heights(y0,y1)
+            return x0,x1,r0,r1,r2,r3,y0-y1,0,1
+
+    def draw_quad(self,x0,y0,x1,y1,x2,y2,x3,y3,color):
+        """Draws a quadrilateral. Included so that this code is more easily adaptable to other platforms."""
+        self.backend.poly(((x0,y0),(x1,y1),(x2,y2),(x3,y3)),color)
+    
+    def draw_pix(self,x0,y0,color):
+        """Sets a pixel at x0,y0 to color Color. Included so that this code is more easily adaptable to other platforms. TBH this shouldn't even be that hard to implement anyways, but you're welcome."""
+        self.backend.pixel(x0,y0,color)
+    
+    def draw_wall(self,player,wall,ttree,fileno,i=None):
+        """Draws a wall. ON THE SCREEN. NO WAY!!!! i is its seg number in the map, for the batch."""
+        x0,x1,r0,r1,r2,r3,yd,u0,u1 = self.project_wall(player,wall,0,i)
+        if (x0,x1,r0,r1,r2,r3) == (-10,0,0,0,0,0):
+            return -1
+        if x0 == x1: return
+        first = max(int(min(x0,x1)),0)
+        last = min(int(max(x0,x1)+1),SCREEN_WIDTH)-1
+        if first > last: return
+        ranges = self.clipper.clip(first,last)
+        if not ranges: return
+        # on screen a wall is SCREEN_HEIGHT/z tall, so its taller end says how near it gets
+        z = SCREEN_HEIGHT / max(abs(r0-r1),abs(r2-r3),EPSILON)
+        if self.lod and (z > self.lod_depth or last - first < self.lod_width):
+            self.flat += 1
+            color = self.shade(ttree.get_color(fileno),z)
+            for a,b in ranges:
+                if b >= self.window[0] and a <= self.window[1]:
+                    self.draw_flat(x0,x1,r0,r1,r2,r3,a,b,color)
+        else:
+            self.textured += 1
+            for a,b in ranges:
+                if b >= self.window[0] and a <= self.window[1]:
+                    self.draw_textured_quad(ttree,fileno,x0,x1,r0,r1,r2,r3,a,b,u0,u1)
+
+    def shade(self,rgb,z):
+        """0xRRGGBB for a flat wall: the texture's average in the light band for z, or without shading darker the further past lod_depth it is."""
+        if self.shading:
+            return shade_rgb(rgb,band_light(min(LIGHT_BANDS-1,int(z * LIGHT_BANDS / LIGHT_DISTANCE))))
+        return shade_rgb(rgb,max(LOD_MIN_LIGHT,min(1,self.lod_depth / z)))
+
+    def draw_flat(self,x0,x1,r0,r1,r2,r3,first,last,color):
+        """Columns first..last of the wall in one colour. Each column gets the rows whose pixel centres are between the top and bottom
+        edge, neighbouring columns that get the same rows share a fillrect. That way the planes know exactly which rows are wall."""
+        xs = self.xscale
+        ys = self.yscale
+        a = (first + xs - 1) // xs # the scaled columns that land inside first..last
+        b = last // xs
+        if a > b: return
+        rows = SCREEN_HEIGHT // ys
+        dx = x1 - x0
+        start = a
+        top = bottom = 0
+        for x in range(a,b+2):
+            if x <= b:
+                t = (x * xs - x0) / dx
+                y0 = (r1 + t * (r3 - r1)) / ys
+                y1 = (r0 + t * (r2 - r0)) / ys
+                if y0 > y1:
+                    y0,y1 = y1,y0
+                t2 = min(max(math.ceil(y0 - 0.5),0),rows)
+                b2 = min(max(math.ceil(y1 - 0.5),0),rows)
+                self.cover(x,t2,b2)
+            else: # past the end, draw what's left
+                t2 = b2 = -1
+            if (t2,b2) != (top,bottom):
+                if x > a and bottom > top:
+                    self.backend.fillrect(start,top,x - start,bottom - top,color,color)
+                    self.filled += (x - start) * (bottom - top)
+                start = x
+                top = t2
+                bottom = b2
+
+    def cover(self,x,top,bottom):
+        """The wall pass drew rows top..bottom-1 of column x, so that's where the ceiling ends and the floor starts."""
+        if top >= bottom: return
+        rows = SCREEN_HEIGHT // self.yscale
+        self.ceiling_clip[x] = min(max(top,0),rows)
+        self.floor_clip[x] = min(max(bottom,0),rows)
+
+    def draw_planes(self,ceiling,floor):
+        """Ceiling and floor after the wall pass: each column's ceiling is the rows above ceiling_clip and its floor the rows from
+        floor_clip down. Both planes go out as horizontal spans merged across neighbouring columns, one fillrect per span,
+        so every pixel of the frame is written once."""
+        rows = SCREEN_HEIGHT // self.yscale
+        first = self.window[0] // self.xscale
+        last = self.window[1] // self.xscale
+        columns = SCREEN_WIDTH // self.xscale
+        self.draw_plane(first,last,[0]*columns,self.ceiling_clip,ceiling)
+        self.draw_plane(first,last,self.floor_clip,[rows]*columns,floor)
+
+    def draw_plane(self,first,last,tops,bottoms,color):
+        """Columns first..last of a plane covering rows tops[x] to bottoms[x]-1 of each column x. Walks the columns keeping the
+        column each row's span started in, a span ends when the next column stops covering its row (the original engine's R_MakeSpans)."""
+        starts = [0] * (SCREEN_HEIGHT // self.yscale)
+        t1 = b1 = 0
+        for x in range(first,last+2):
+            if x <= last:
+                t2 = tops[x]
+                b2 = bottoms[x]
+            else: # past the end, close everything
+                t2 = b2 = 0
+            for y in range(t1,min(b1,t2)):
+                self.span(starts[y],x,y,color)
+            for y in range(max(t1,b2),b1):
+                self.span(starts[y],x,y,color)
+            for y in range(t2,min(b2,t1)):
+                starts[y] = x
+            for y in range(max(t2,b1),b2):
+                starts[y] = x
+            t1 = t2
+            b1 = b2
+
+    def span(self,x0,x1,y,color):
+        """Row y from column x0 up to x1 (exclusive)."""
+        self.planes += 1
+        self.filled += x1 - x0
+        self.backend.fillrect(x0,y,x1 - x0,1,color,color)
+
+    def draw_strip(self,x,y0,y1,slot,px,h=128):
+        """Draws texture column px of the texture at slot (grob,x,y) stretched over screen column x from y0 to y1. One BLIT_P instead of one PIXON_P per pixel.
+        x, y0 and y1 are in the scaled down frame when xscale/yscale aren't 1."""
+        height = y1 - y0
+        rows = SCREEN_HEIGHT // self.yscale
+        sv0 = 0
+        sv1 = h
+        # Crop to the screen on whole texel rows so the texels still line up with the per-pixel path
+        if y0 < 0:
+            sv0 = min(h-1,int(-y0 * h / height))
+        if y1 > rows:
+            sv1 = max(sv0+1,min(h,int((rows - y0) * h / height) + 1))
+        ty0 = y0 + sv0 * height / h
+        ty1 = y0 + sv1 * height / h
+        self.backend.strip(x,int(ty0),int(ty1)+1,slot[0],slot[1]+px,slot[2]+sv0,slot[2]+sv1)
+        self.cover(x,int(ty0),int(ty1)+1)
+
+    def draw_textured_quad(self,ttree:TextureTree,fileno,x0,x1,r0,r1,r2,r3,first=0,last=SCREEN_WIDTH-1,u0=0,u1=1,w=128,h=128):
+        """Textured wall between x0 and x1, only columns first..last get drawn. u0/u1 is the part of the texture the wall covers.
+        Nothing gets divided per pixel: the edges and 1/z step linearly per column (a wall's height on screen is 1/z times a constant),
+        u is u/z over 1/z so it's perspective correct, and the per-pixel path steps v in 16.16 fixed point."""
+        if x0 == x1: return
+        if x0 > x1: # seen from behind, mirror it
+            x0, x1 = x1, x0
+            r0, r1, r2, r3 = r2, r3, r0, r1
+            u0, u1 = u1, u0
+        start = max(int(x0),first,0)
+        end = min(int(x1+1),last+1,SCREEN_WIDTH)
+        xs = self.xscale
+        ys = self.yscale
+        if xs > 1: # only the columns that land on a multiple of xscale get drawn
+            start = (start + xs - 1) // xs * xs
+        if start >= end: return
+        dx = x1 - x0
+        t = (start - x0) / dx
+        iz0 = r0 - r1
+        iz1 = r2 - r3
+        bottom = r0 + t * (r2 - r0)
+        top = r1 + t * (r3 - r1)
+        iz = iz0 + t * (iz1 - iz0)
+        uz = u0 * iz0 + t * (u1 * iz1 - u0 * iz0)
+        dbottom = (r2 - r0) / dx
+        dtop = (r3 - r1) / dx
+        diz = (iz1 - iz0) / dx
+        duz = (u1 * iz1 - u0 * iz0) / dx
+        if xs > 1:
+            dtop *= xs
+            dbottom *= xs
+            diz *= xs
+            duz *= xs
+        rows = SCREEN_HEIGHT // ys
+        first, last = self.window # columns outside still get stepped over so the ones inside add up the same
+        shading = self.shading
+        if shading:
+            indices, colormaps = ttree.decoded(fileno)
+            bands = LIGHT_BANDS * SCREEN_HEIGHT / LIGHT_DISTANCE # iz is the wall's height on screen, SCREEN_HEIGHT/z
+        else:
+            slot = ttree.get_texture_slot(fileno)
+        for i in range(start,end,xs):
+            y0 = top / ys
+            y1 = bottom / ys
+            if y0 > y1:
+                y0,y1 = y1,y0
+            if first <= i <= last and y1 - y0 != 0 and iz != 0:
+                px = int(uz / iz * w) % w
+                if shading:
+                    band = min(LIGHT_BANDS-1,int(bands / abs(iz)))
+                if self.spans:
+                    if shading:
+                        self.draw_strip(i // xs,y0,y1,self.columns.get(ttree,fileno,px,band),0,h)
+                    else:
+                        self.draw_strip(i // xs,y0,y1,slot,px,h)
+                else:
+                    j0 = max(int(y0),0)
+                    step = int(h * 65536 / (y1 - y0))
+                    v = int((j0 - y0) * step)
+                    if shading:
+                        colormap = colormaps[band]
+                        column = px * h
+                    self.cover(i // xs,j0,min(int(y1+1),rows))
+                    for j in range(j0,min(int(y1+1),rows)):
+                        if shading:
+                            self.draw_pix(i // xs,j,colormap[indices[column + ((v >> 16) % h)]])
+                        else:
+                            self.draw_pix(i // xs,j,self.backend.texel(slot[0],slot[1]+px,slot[2]+((v >> 16) % h)))
+                        v += step
+            top += dtop
+            bottom += dbottom
+            iz += diz
+            uz += duz
+
+
+class Player:
+    def __init__(self,x,y,r):
+        self.x = x
+        self.y = y 
+        self.r = r
+
@@ -0,0 +1,851 @@
+"""Level data: walls, the BSP builder and the flat BSPMap the game runs off, the WAD reader, the blockmap for collisions
+and the PVS. Nothing in here draws anything, make_wad.py uses it on the desktop to compile levels."""
+import math
+import struct
+from array import array
+
+EPSILON = 1e-6
+RAD_CONST = math.pi / 180
+DEFAULT_TEXTURE = "brick.jpg"
+MAP_FILE = "doom.bsp" # compiled map cache for when the level's NODES lump is missing or stale
+MAP_MAGIC = b"HPDB"
+MAP_VERSION = 2
+LEVEL_LUMPS = ("VERTEXES","LINEDEFS","TEXTURES","NODES","PVS")
+PORTAL_EPSILON = 1e-5 # how close counts as on a line when make_wad.py works out the portals between leaves for the PVS
+
+class Point:
+    """2D coordinate with x/y values."""
+    __slots__ = ("x","y")
+    def __init__(self,x,y):
+        self.x = x
+        self.y = y
+
+class Wall:
+    """Generic wall object lol"""
+    __slots__ = ("start","end","texture","v0","v1","dx","dy")
+    def __init__(self,start,end,texture=DEFAULT_TEXTURE):
+        self.start = start
+        self.end = end
+        self.texture = texture
+        self.v0 = None # indices into the vertex table once build_vertex_table has run
+        self.v1 = None
+        if type(start) == type(()) or type(start) == type([]): self.start = Point(start[0], start[1])
+        if type(end) == type(()) or type(end) == type([]): self.end = Point(end[0], end[1])
+        self.dx = self.end.x - self.start.x
+        self.dy = self.end.y - self.start.y
+
+Linedef = Wall
+
+class BSPNode:
+    """BSP tree node obviously. Only what BSPBuilder hands to pack_map, the game runs off a BSPMap."""
+    __slots__ = ("partition","left","right","segments","bbox","textures")
+    def __init__(self,partition,left=None,right=None,segments=None,textures=(),bbox=None):
+        self.partition = partition
+        self.left = left
+        self.right = right
+        self.segments = segments if segments is not None else []
+        self.bbox = bbox # (minx,miny,maxx,maxy) of everything in this subtree
+        self.textures = textures # textures of this node's own segments, for prefetching
+
+class Seg:
+    """One wall of a BSPMap as the renderer sees it: vertex indices and texture."""
+    __slots__ = ("v0","v1","texture")
+    def __init__(self,v0,v1,texture):
+        self.v0 = v0
+        self.v1 = v1
+        self.texture = texture
+
+FRONT = -1
+ON = 0
+BACK = 1
+SPAN = 2
+
+def line_side(line,px,py,dx,dy):
+    """Which side of the partition through px,py going dx,dy the line is on. Returns (FRONT/ON/BACK/SPAN, start side value, end side value)."""
+    eps = EPSILON * (abs(dx) + abs(dy))
+    start = ((line.start.x - px) * dy) - ((line.start.y - py) * dx)
+    end = ((line.end.x - px) * dy) - ((line.end.y - py) * dx)
+    if -eps <= start <= eps: start = 0
+    if -eps <= end <= eps: end = 0
+    if start >= 0 and end >= 0:
+        side = ON if start == end == 0 else BACK
+    elif start <= 0 and end <= 0:
+        side = FRONT
+    else:
+        side = SPAN
+    return side, start, end
+
+class BSPBuilder:
+    """Builds the BSP tree. Each partition is the candidate with the lowest split_cost*splits + balance_cost*|front-back|, so it goes for few
+    splits but not at the price of a lopsided tree. With more than sample lines only an evenly spaced sample of them get tried as partitions.
+    nodes/splits/depth describe the last build."""
+    def __init__(self,split_cost=8,balance_cost=1,sample=12):
+        self.split_cost = split_cost
+        self.balance_cost = balance_cost
+        self.sample = sample
+        self.nodes = 0
+        self.splits = 0
+        self.depth = 0
+
+    def stats(self):
+        return {"nodes": self.nodes, "splits": self.splits, "depth": self.depth}
+
+    def find_partition(self,linedefs):
+        step = 1
+        if len(linedefs) > self.sample:
+            step = (len(linedefs) + self.sample - 1) // self.sample
+        best = None
+        best_cost = None
+        for k in range(0,len(linedefs),step):
+            candidate = linedefs[k]
+            px = candidate.start.x
+            py = candidate.start.y
+            dx = candidate.end.x - px
+            dy = candidate.end.y - py
+            if dx == 0 and dy == 0: continue # a point can't split anything
+            eps = EPSILON * (abs(dx) + abs(dy))
+            front = 0
+            back = 0
+            splits = 0
+            left = len(linedefs)
+            for line in linedefs:
+                left -= 1
+                # line_side inlined, this loop is most of the build time
+                start = ((line.start.x - px) * dy) - ((line.start.y - py) * dx)
+                end = ((line.end.x - px) * dy) - ((line.end.y - py) * dx)
+                if -eps <= start <= eps: start = 0
+                if -eps <= end <= eps: end = 0
+                if start >= 0 and end >= 0:
+                    if start != 0 or end != 0: back += 1
+                elif start <= 0 and end <= 0:
+                    front += 1
+                else:
+                    splits += 1
+                    front += 1
+                    back += 1
+                if best_cost is not None and self.split_cost * splits + self.balance_cost * (abs(front - back) - left) >= best_cost:
+                    break # can't win even if everything left evens it out
+            else:
+                cost = self.split_cost * splits + self.balance_cost * abs(front - back)
+                if best_cost is None or cost < best_cost:
+                    best = candidate
+                    best_cost = cost
+                    if cost == 0:
+                        break
+        return best
+
+    def build(self,linedefs,depth=1):
+        if not linedefs:
+            return
+        if depth == 1:
+            self.nodes = 0
+            self.splits = 0
+            self.depth = 0
+        partition = self.find_partition(linedefs)
+        if partition is None: # nothing but zero length walls left
+            return
+        px = partition.start.x
+        py = partition.start.y
+        dx = partition.end.x - px
+        dy = partition.end.y - py
+        front_division = []
+        back_division = []
+        on_division = []
+
+        for line in linedefs:
+            side, start, end = line_side(line,px,py,dx,dy)
+            if side == BACK: back_division.append(line)
+            elif side == FRONT: front_division.append(line)
+            elif side == ON: on_division.append(line)
+            else:
+                t = start / (start - end)
+                point = Point(line.start.x + t * (line.end.x - line.start.x), line.start.y + t * (line.end.y - line.start.y))
+                a = Linedef(line.start,point,line.texture)
+                b = Linedef(point,line.end,line.texture)
+                if start < 0:
+                    front_division.append(a)
+                    back_division.append(b)
+                else:
+                    back_division.append(a)
+                    front_division.append(b)
+                self.splits += 1
+        self.nodes += 1
+        self.depth = max(self.depth,depth)
+        textures = []
+        for line in on_division:
+            if line.texture not in textures:
+                textures.append(line.texture)
+        return BSPNode(partition,
+            left=self.build(front_division,depth+1),
+            right=self.build(back_division,depth+1),
+            segments=on_division,
+            textures=textures,
+            bbox=bounding_box(linedefs)
+                       )
+
+def build_vertex_table(node,vertices=None,index=None):
+    """Gives every segment in the tree shared start/end points and their indices in one deduplicated vertex list, so each vertex is projected once a frame."""
+    if vertices is None:
+        vertices = []
+        index = {}
+    if not node:
+        return vertices
+    for seg in node.segments:
+        for end in ("start","end"):
+            point = getattr(seg,end)
+            key = (point.x,point.y)
+            if key not in index:
+                index[key] = len(vertices)
+                vertices.append(point)
+            i = index[key]
+            setattr(seg,end,vertices[i])
+            if end == "start": seg.v0 = i
+            else: seg.v1 = i
+    build_vertex_table(node.left,vertices,index)
+    build_vertex_table(node.right,vertices,index)
+    return vertices
+
+def bounding_box(linedefs):
+    xs = [line.start.x for line in linedefs] + [line.end.x for line in linedefs]
+    ys = [line.start.y for line in linedefs] + [line.end.y for line in linedefs]
+    return (min(xs),min(ys),max(xs),max(ys))
+
+def build_bsp(linedefs,builder=None):
+    """Builds the tree with builder (default settings if None). builder.stats() has the numbers afterwards."""
+    if builder is None:
+        builder = BSPBuilder()
+    return builder.build(linedefs)
+
+def map_hash(linedefs,builder):
+    """32 bit FNV-1a of the walls, their textures and the builder settings. Coordinates go in as integers so CPython and the calculator agree."""
+    h = 2166136261
+    text = "{0};{1},{2},{3};".format(MAP_VERSION,builder.split_cost,builder.balance_cost,builder.sample)
+    for line in linedefs:
+        text += "{0},{1},{2},{3},{4};".format(round(line.start.x*1000),round(line.start.y*1000),round(line.end.x*1000),round(line.end.y*1000),line.texture)
+    for c in text.encode():
+        h = ((h ^ c) * 16777619) & 0xFFFFFFFF
+    return h
+
+def pack_map(tree,vertices,h):
+    """Flattens a built tree into little endian bytes:
+    header, texture names, vertices (2 floats), segments (v0,v1,texture), nodes (partition,left,right,first segment,segment count,
+    first texture ref,texture ref count) in preorder, node boxes (4 floats), node texture refs. Returns (data,nodes,segments,vertices)."""
+    textures = []
+    segments = []
+    nodes = []
+    boxes = []
+    texrefs = []
+    def walk(node):
+        if not node:
+            return -1
+        i = len(nodes)
+        nodes.append(None)
+        first = len(segments)
+        for seg in [node.partition] + [seg for seg in node.segments if seg is not node.partition]:
+            if seg.texture not in textures:
+                textures.append(seg.texture)
+            segments.extend((seg.v0,seg.v1,textures.index(seg.texture)))
+        firsttex = len(texrefs)
+        for name in node.textures:
+            if name not in textures:
+                textures.append(name)
+            texrefs.append(textures.index(name))
+        boxes.extend(node.bbox)
+        head = (first//3,len(segments)//3 - first//3,firsttex,len(texrefs) - firsttex)
+        left = walk(node.left)
+        right = walk(node.right)
+        nodes[i] = (head[0],left,right,head[0],head[1],head[2],head[3])
+        return i
+    walk(tree)
+    out = [struct.pack("<4sHIHHHHH",MAP_MAGIC,MAP_VERSION,h,len(vertices),len(segments)//3,len(nodes),len(textures),len(texrefs))]
+    for name in textures:
+        name = name.encode()
+        out.append(struct.pack("<B",len(name)) + name)
+    coords = []
+    for point in vertices:
+        coords.extend((point.x,point.y))
+    out.append(struct.pack("<{0}f".format(len(coords)),*coords))
+    out.append(struct.pack("<{0}h".format(len(segments)),*segments))
+    flat = []
+    for node in nodes:
+        flat.extend(node)
+    out.append(struct.pack("<{0}h".format(len(flat)),*flat))
+    out.append(struct.pack("<{0}f".format(len(boxes)),*boxes))
+    out.append(struct.pack("<{0}h".format(len(texrefs)),*texrefs))
+    return b"".join(out),len(nodes),len(segments)//3,len(vertices)
+
+def write_map(path,tree,vertices,h):
+    """pack_map into a file. Returns (nodes,segments,vertices)."""
+    packed = pack_map(tree,vertices,h)
+    f = open(path,"wb")
+    f.write(packed[0])
+    f.close()
+    return packed[1:]
+
+class BSPMap:
+    """A compiled map as flat arrays instead of objects: vertices as float arrays, segments as short arrays of vertex and texture
+    indices, and per node the partition as a*x + b*y + c (negative = front = left child), child indices (-1 = none), segment and
+    texture ref ranges, box and leaf range. Node 0 is the root. segs has a Seg view per segment for the drawing code."""
+    __slots__ = ("vx","vy","seg_v0","seg_v1","seg_tex","segs","textures","a","b","c","left","right","first","count",
+                 "box","tex_first","tex_count","texrefs","leaf_first","leaf_end","leaves")
+    def __init__(self,textures,coords,segdata,nodedata,boxes,refs):
+        self.textures = textures
+        self.vx = array("f",coords[0::2])
+        self.vy = array("f",coords[1::2])
+        self.seg_v0 = array("h",segdata[0::3])
+        self.seg_v1 = array("h",segdata[1::3])
+        self.seg_tex = array("h",segdata[2::3])
+        self.segs = [Seg(self.seg_v0[i],self.seg_v1[i],textures[self.seg_tex[i]]) for i in range(len(self.seg_v0))]
+        self.left = array("h",nodedata[1::7])
+        self.right = array("h",nodedata[2::7])
+        self.first = array("h",nodedata[3::7])
+        self.count = array("h",nodedata[4::7])
+        self.tex_first = array("h",nodedata[5::7])
+        self.tex_count = array("h",nodedata[6::7])
+        self.box = array("f",boxes)
+        self.texrefs = array("h",refs)
+        n = len(self.left)
+        self.a = array("f",[0]*n)
+        self.b = array("f",[0]*n)
+        self.c = array("f",[0]*n)
+        for i in range(n): # (x-px)*dy - (y-py)*dx like line_side, multiplied out
+            part = nodedata[7*i]
+            x0 = self.vx[self.seg_v0[part]]
+            y0 = self.vy[self.seg_v0[part]]
+            dx = self.vx[self.seg_v1[part]] - x0
+            dy = self.vy[self.seg_v1[part]] - y0
+            self.a[i] = dy
+            self.b[i] = -dx
+            self.c[i] = y0 * dx - x0 * dy
+        self.leaf_first = array("h",[0]*n)
+        self.leaf_end = array("h",[0]*n)
+        self.leaves = self.number_leaves()
+
+    def number_leaves(self):
+        """The empty child slots are the leaves, convex regions with no walls inside. Numbers them left to right (the order
+        leaf_regions and the PVS use) and fills in every node's leaf_first/leaf_end. Returns how many there are."""
+        leaf = 0
+        stack = [0]
+        while stack:
+            n = stack.pop()
+            if n is None: # an empty child slot
+                leaf += 1
+            elif n < 0: # everything under ~n is numbered
+                self.leaf_end[~n] = leaf
+            else:
+                self.leaf_first[n] = leaf
+                stack.append(~n)
+                stack.append(self.right[n] if self.right[n] >= 0 else None)
+                stack.append(self.left[n] if self.left[n] >= 0 else None)
+        return leaf
+
+    def side(self,n,x,y):
+        """Which side of node n's partition x,y is on, < 0 is the front (left) one."""
+        return self.a[n] * x + self.b[n] * y + self.c[n]
+
+def unpack_map(data,h=None):
+    """Turns pack_map bytes into a BSPMap. None if it's from another version, h doesn't match or it has no nodes."""
+    size = struct.calcsize("<4sHIHHHHH")
+    if len(data) < size:
+        return None
+    magic,version,fh,nvert,nseg,nnode,ntex,nref = struct.unpack("<4sHIHHHHH",data[:size])
+    if magic != MAP_MAGIC or version != MAP_VERSION or (h is not None and fh != h) or nnode == 0:
+        return None
+    pos = size
+    def take(fmt,n):
+        nonlocal pos
+        out = struct.unpack("<{0}{1}".format(n,fmt),data[pos:pos + n * struct.calcsize(fmt)])
+        pos += n * struct.calcsize(fmt)
+        return out
+    textures = []
+    for i in range(ntex):
+        n = data[pos]
+        textures.append(data[pos+1:pos+1+n].decode())
+        pos += 1 + n
+    coords = take("f",nvert*2)
+    segdata = take("h",nseg*3)
+    nodedata = take("h",nnode*7)
+    boxes = take("f",nnode*4)
+    refs = take("h",nref)
+    return BSPMap(textures,coords,segdata,nodedata,boxes,refs)
+
+def read_map(path,h=None):
+    """unpack_map from a file, None if it isn't there."""
+    try:
+        f = open(path,"rb")
+    except OSError:
+        return None
+    data = f.read()
+    f.close()
+    return unpack_map(data,h)
+
+def load_map(linedefs,path,builder,compiled=None):
+    """BSPMap for linedefs from the compiled bytes if they're current, then from the cache file at path, otherwise builds it and tries to save it
+    to path for next time. Returns (map,hash), map is None for a level without walls."""
+    h = map_hash(linedefs,builder)
+    loaded = None
+    if compiled is not None:
+        loaded = unpack_map(compiled,h)
+    if loaded is None:
+        loaded = read_map(path,h)
+    if loaded is not None:
+        return loaded,h
+    tree = build_bsp(linedefs,builder)
+    if tree is None:
+        return None,h
+    vertices = build_vertex_table(tree)
+    data = pack_map(tree,vertices,h)[0]
+    try:
+        f = open(path,"wb")
+        f.write(data)
+        f.close()
+    except OSError:
+        pass # read only storage, just build it every time then
+    return unpack_map(data),h
+
+def data_path(name):
+    """name next to doom.py. The calculator runs us from the app's folder so there it's just name."""
+    try:
+        base = __file__
+    except NameError:
+        return name
+    i = max(base.rfind("/"),base.rfind("\\"))
+    return name if i < 0 else base[:i+1] + name
+
+class WadReader:
+    """WAD style container: "PWAD", lump count, directory offset, then a directory of (offset,size,8 byte name). A level is a zero size marker
+    lump (E1M1...) followed by its VERTEXES/LINEDEFS/TEXTURES/NODES lumps. Only the lumps that get asked for are read: desktop Python maps the
+    file, the calculator seeks to each lump."""
+    def __init__(self,path):
+        self.f = open(path,"rb")
+        self.map = None
+        try:
+            import mmap
+            self.map = mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+        except (ImportError, AttributeError, OSError, ValueError):
+            pass
+        magic, count, offset = struct.unpack("<4sii",self.read(0,12))
+        if magic != b"PWAD" and magic != b"IWAD":
+            raise ValueError("not a WAD: " + path)
+        directory = self.read(offset,16*count)
+        self.lumps = [] # (name,offset,size)
+        for i in range(count):
+            pos, size, name = struct.unpack("<ii8s",directory[16*i:16*i+16])
+            self.lumps.append((name.rstrip(b"\0").decode(),pos,size))
+
+    def read(self,pos,size):
+        if self.map is not None:
+            return self.map[pos:pos+size]
+        self.f.seek(pos)
+        return self.f.read(size)
+
+    def level(self,name):
+        """{lump name: bytes} for one level."""
+        for i in range(len(self.lumps)):
+            if self.lumps[i][0] == name and self.lumps[i][2] == 0:
+                break
+        else:
+            raise KeyError("no level " + name)
+        out = {}
+        for lump, pos, size in self.lumps[i+1:]:
+            if lump not in LEVEL_LUMPS: break
+            out[lump] = self.read(pos,size)
+        return out
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.f.close()
+
+def level_walls(lumps):
+    """Walls of a level from its VERTEXES (float pairs), LINEDEFS (v0,v1,texture shorts) and TEXTURES (count, then length prefixed names) lumps."""
+    data = lumps["VERTEXES"]
+    coords = struct.unpack("<{0}f".format(len(data)//4),data)
+    points = [Point(coords[2*i],coords[2*i+1]) for i in range(len(coords)//2)]
+    data = lumps.get("TEXTURES",b"")
+    textures = []
+    pos = 2
+    for i in range(struct.unpack("<H",data[:2])[0] if data else 0):
+        n = data[pos]
+        textures.append(data[pos+1:pos+1+n].decode())
+        pos += 1 + n
+    data = lumps["LINEDEFS"]
+    lines = struct.unpack("<{0}h".format(len(data)//2),data)
+    walls = []
+    for i in range(0,len(lines),3):
+        a = points[lines[i]]
+        b = points[lines[i+1]]
+        walls.append(Wall(Point(a.x,a.y),Point(b.x,b.y),textures[lines[i+2]] if textures else DEFAULT_TEXTURE))
+    return walls
+
+def load_level(path,name,builder):
+    """Reads level name out of the WAD at path and gets its tree (NODES lump, then the cache file, then a fresh build).
+    Returns (map,hash,walls,pvs), pvs is None without an up to date PVS lump. A missing WAD gives an empty level so desktop tools still start."""
+    try:
+        wad = WadReader(path)
+    except OSError:
+        print("no " + path + ", empty level")
+        return None,0,[],None
+    lumps = wad.level(name)
+    wad.close()
+    walls = level_walls(lumps)
+    m, h = load_map(walls,data_path(MAP_FILE),builder,lumps.get("NODES"))
+    return m,h,walls,load_pvs(lumps.get("PVS"),m,h)
+
+def segment_hits_box(x0,y0,x1,y1,minx,miny,maxx,maxy):
+    """Liang-Barsky: does the segment touch the box at all."""
+    t0 = 0.0
+    t1 = 1.0
+    dx = x1 - x0
+    dy = y1 - y0
+    for p,q in ((-dx,x0-minx),(dx,maxx-x0),(-dy,y0-miny),(dy,maxy-y0)):
+        if p == 0:
+            if q < 0: return False
+        else:
+            r = q / p
+            if p < 0:
+                if r > t1: return False
+                if r > t0: t0 = r
+            else:
+                if r < t0: return False
+                if r < t1: t1 = r
+    return True
+
+def point_segment_dist2(px,py,wall):
+    """Squared distance from px,py to the closest point of wall."""
+    dx = wall.end.x - wall.start.x
+    dy = wall.end.y - wall.start.y
+    l2 = dx*dx + dy*dy
+    t = 0
+    if l2 > 0:
+        t = ((px - wall.start.x) * dx + (py - wall.start.y) * dy) / l2
+        t = min(1,max(0,t))
+    cx = wall.start.x + t * dx - px
+    cy = wall.start.y + t * dy - py
+    return cx*cx + cy*cy
+
+class Blockmap:
+    """Uniform grid over the level's bounds where each cell lists the walls crossing it, so collision and "what's near here"
+    only look at a few cells instead of every wall."""
+    def __init__(self,walls,cell=2.0):
+        self.cell = cell
+        self.tests = 0 # wall distance checks done by blocked(), for seeing what it saves
+        if not walls:
+            walls = []
+            self.x0 = self.y0 = 0
+            self.cols = self.rows = 1
+        else:
+            box = bounding_box(walls)
+            self.x0 = box[0]
+            self.y0 = box[1]
+            self.cols = int((box[2] - box[0]) / cell) + 1
+            self.rows = int((box[3] - box[1]) / cell) + 1
+        self.cells = [[] for i in range(self.cols * self.rows)]
+        for wall in walls:
+            c0,r0 = self.cell_of(min(wall.start.x,wall.end.x),min(wall.start.y,wall.end.y))
+            c1,r1 = self.cell_of(max(wall.start.x,wall.end.x),max(wall.start.y,wall.end.y))
+            for r in range(r0,r1+1):
+                for c in range(c0,c1+1):
+                    x = self.x0 + c * cell
+                    y = self.y0 + r * cell
+                    if segment_hits_box(wall.start.x,wall.start.y,wall.end.x,wall.end.y,x,y,x+cell,y+cell):
+                        self.cells[r * self.cols + c].append(wall)
+
+    def cell_of(self,x,y):
+        """(column,row) of the cell x,y falls in, clamped to the grid."""
+        c = min(max(int((x - self.x0) / self.cell),0),self.cols-1)
+        r = min(max(int((y - self.y0) / self.cell),0),self.rows-1)
+        return c,r
+
+    def walls_in_box(self,minx,miny,maxx,maxy):
+        """Every wall in a cell the box touches, each once. Walls in those cells can still be outside the box."""
+        c0,r0 = self.cell_of(minx,miny)
+        c1,r1 = self.cell_of(maxx,maxy)
+        if c0 == c1 and r0 == r1:
+            return self.cells[r0 * self.cols + c0]
+        found = []
+        for r in range(r0,r1+1):
+            for c in range(c0,c1+1):
+                for wall in self.cells[r * self.cols + c]:
+                    if wall not in found:
+                        found.append(wall)
+        return found
+
+    def walls_near(self,x,y,radius):
+        """Walls that come within radius of x,y."""
+        r2 = radius * radius
+        return [wall for wall in self.walls_in_box(x-radius,y-radius,x+radius,y+radius) if point_segment_dist2(x,y,wall) <= r2]
+
+    def blocked(self,x,y,radius,box=None):
+        """True if a circle of radius at x,y overlaps a wall. box limits the cells looked at, it has to contain the circle."""
+        if box is None:
+            box = (x-radius,y-radius,x+radius,y+radius)
+        r2 = radius * radius
+        for wall in self.walls_in_box(box[0],box[1],box[2],box[3]):
+            self.tests += 1
+            if point_segment_dist2(x,y,wall) < r2:
+                return True
+        return False
+
+    def move(self,player,dx,dy,radius):
+        """Moves player by dx,dy unless that hits a wall, in which case it slides along whichever axis is still free.
+        Only walls in the cells the move sweeps through get tested. Returns False if it couldn't move at all."""
+        x = player.x
+        y = player.y
+        sweep = (min(x,x+dx)-radius,min(y,y+dy)-radius,max(x,x+dx)+radius,max(y,y+dy)+radius)
+        for nx,ny in ((x+dx,y+dy),(x+dx,y),(x,y+dy)):
+            if (nx,ny) != (x,y) and not self.blocked(nx,ny,radius,sweep):
+                player.x = nx
+                player.y = ny
+                return True
+        return False
+
+    def stats(self):
+        counts = [len(cell) for cell in self.cells]
+        used = [n for n in counts if n]
+        return {"cell": self.cell, "cols": self.cols, "rows": self.rows,
+                "walls_per_cell": sum(counts) / len(counts),
+                "walls_per_used_cell": sum(used) / len(used) if used else 0,
+                "max_walls": max(counts)}
+
+def clip_polygon(polygon,m,n,side):
+    """The part of a convex polygon on side (-1 front, 1 back) of node n's partition."""
+    out = []
+    for k in range(len(polygon)):
+        ax,ay = polygon[k-1]
+        bx,by = polygon[k]
+        a = side * m.side(n,ax,ay)
+        b = side * m.side(n,bx,by)
+        if a >= 0 and b >= 0:
+            out.append((bx,by))
+        elif a >= 0 or b >= 0:
+            t = a / (a - b)
+            out.append((ax + t * (bx - ax),ay + t * (by - ay)))
+            if b >= 0:
+                out.append((bx,by))
+    return out
+
+def leaf_regions(m,box):
+    """Polygon of every leaf of BSPMap m in leaf number order, box being the polygon the whole map is cut out of."""
+    regions = []
+    stack = [(0,box)]
+    while stack:
+        n, polygon = stack.pop()
+        for child, side in ((m.right[n],1),(m.left[n],-1)):
+            part = clip_polygon(polygon,m,n,side)
+            stack.append((child,part) if child >= 0 else (None,part))
+        while stack and stack[-1][0] is None: # leaves come off in order since left is pushed last
+            regions.append(stack.pop()[1])
+    return regions
+
+def collinear(ax,ay,bx,by,cx,cy,dx,dy,eps=PORTAL_EPSILON):
+    """True if c and d are both on the line through a and b."""
+    length = math.sqrt((bx - ax) ** 2 + (by - ay) ** 2)
+    if length < eps:
+        return False
+    return (abs((cx - ax) * (by - ay) - (cy - ay) * (bx - ax)) <= eps * length and
+            abs((dx - ax) * (by - ay) - (dy - ay) * (bx - ax)) <= eps * length)
+
+def leaf_portals(regions,walls,eps=PORTAL_EPSILON):
+    """The openings between neighbouring leaves: every stretch of edge two leaf polygons share that no wall lies along.
+    Returns a list per leaf of (neighbour,(x0,y0,x1,y1)), each opening listed from both sides."""
+    edges = []
+    for leaf in range(len(regions)):
+        polygon = regions[leaf]
+        if len(polygon) < 3: continue
+        for k in range(len(polygon)):
+            ax,ay = polygon[k-1]
+            bx,by = polygon[k]
+            if abs(bx - ax) + abs(by - ay) > eps:
+                edges.append((leaf,ax,ay,bx,by))
+    portals = [[] for leaf in regions]
+    for e in range(len(edges)):
+        a,ax,ay,bx,by = edges[e]
+        length = math.sqrt((bx - ax) ** 2 + (by - ay) ** 2)
+        ux = (bx - ax) / length
+        uy = (by - ay) / length
+        for f in range(e + 1,len(edges)):
+            b,cx,cy,dx,dy = edges[f]
+            if b == a or not collinear(ax,ay,bx,by,cx,cy,dx,dy): continue
+            # overlap along a's edge, then take out whatever walls lie along it
+            tc = (cx - ax) * ux + (cy - ay) * uy
+            td = (dx - ax) * ux + (dy - ay) * uy
+            lo = max(0,min(tc,td))
+            hi = min(length,max(tc,td))
+            if hi - lo <= eps: continue
+            gaps = [(lo,hi)]
+            for wall in walls:
+                wx0 = wall.start.x
+                wy0 = wall.start.y
+                wx1 = wall.end.x
+                wy1 = wall.end.y
+                if not collinear(ax,ay,bx,by,wx0,wy0,wx1,wy1): continue
+                t0 = (wx0 - ax) * ux + (wy0 - ay) * uy
+                t1 = (wx1 - ax) * ux + (wy1 - ay) * uy
+                w0 = min(t0,t1)
+                w1 = max(t0,t1)
+                left = []
+                for g0,g1 in gaps:
+                    if w1 <= g0 or w0 >= g1:
+                        left.append((g0,g1))
+                        continue
+                    if w0 - g0 > eps: left.append((g0,w0))
+                    if g1 - w1 > eps: left.append((w1,g1))
+                gaps = left
+            for g0,g1 in gaps:
+                portal = (ax + ux * g0,ay + uy * g0,ax + ux * g1,ay + uy * g1)
+                portals[a].append((b,portal))
+                portals[b].append((a,portal))
+    return portals
+
+def separators(source,through):
+    """Lines through an end of source and an end of through with source on one side and through on the other, as (x,y,dx,dy,side).
+    Any line crossing both portals carries on along the side of them through is on."""
+    ends = ((source[0],source[1]),(source[2],source[3]))
+    found = []
+    for sx,sy in ends:
+        ox,oy = ends[1] if (sx,sy) == ends[0] else ends[0]
+        for px,py,qx,qy in ((through[0],through[1],through[2],through[3]),(through[2],through[3],through[0],through[1])):
+            dx = px - sx
+            dy = py - sy
+            if abs(dx) + abs(dy) <= PORTAL_EPSILON: continue
+            a = (ox - sx) * dy - (oy - sy) * dx
+            b = (qx - sx) * dy - (qy - sy) * dx
+            if a * b > 0 or (a == 0 and b == 0): continue
+            found.append((sx,sy,dx,dy,1 if b > 0 or (b == 0 and a < 0) else -1))
+    return found
+
+def clip_portal(portal,lines):
+    """The part of portal on the kept side of every separator, None if nothing's left."""
+    x0,y0,x1,y1 = portal
+    for sx,sy,dx,dy,side in lines:
+        a = side * ((x0 - sx) * dy - (y0 - sy) * dx)
+        b = side * ((x1 - sx) * dy - (y1 - sy) * dx)
+        if a >= 0 and b >= 0: continue
+        if a < 0 and b < 0: return None
+        t = a / (a - b)
+        mx = x0 + t * (x1 - x0)
+        my = y0 + t * (y1 - y0)
+        if a < 0:
+            x0,y0 = mx,my
+        else:
+            x1,y1 = mx,my
+    if abs(x1 - x0) + abs(y1 - y0) <= PORTAL_EPSILON:
+        return None
+    return x0,y0,x1,y1
+
+def pvs_row(i,portals):
+    """Leaves leaf i can possibly see, like the original engine's vis: flows out through each of i's portals, and on into further
+    leaves only through the part of each portal a straight line from that first portal could still get through. Clipping only
+    to the separators of the first portal and the last one passed keeps it from ever under-counting. make_wad.py runs these in parallel."""
+    seen = set([i])
+    for first, source in portals[i]:
+        seen.add(first)
+        stack = [(first,None,(i,first))]
+        while stack:
+            leaf, through, path = stack.pop()
+            lines = separators(source,through) if through is not None else []
+            for target, portal in portals[leaf]:
+                if target in path: continue # a straight line crosses a convex leaf once
+                part = clip_portal(portal,lines)
+                if part is None: continue
+                seen.add(target)
+                stack.append((target,part,path + (target,)))
+    return sorted(seen)
+
+def compress_row(leaves,count):
+    """Bit vector of the leaves, then runs of zero bytes squashed into 0,length like the original engine's vis data."""
+    bits = bytearray((count + 7) // 8)
+    for leaf in leaves:
+        bits[leaf >> 3] |= 1 << (leaf & 7)
+    out = bytearray()
+    i = 0
+    while i < len(bits):
+        if bits[i]:
+            out.append(bits[i])
+            i += 1
+        else:
+            run = 1
+            while i + run < len(bits) and run < 255 and not bits[i + run]:
+                run += 1
+            out.append(0)
+            out.append(run)
+            i += run
+    return bytes(out)
+
+def pack_pvs(rows,h):
+    """PVS lump: map hash, leaf count, an offset per leaf into the compressed rows that follow."""
+    data = [compress_row(row,len(rows)) for row in rows]
+    offsets = []
+    pos = 0
+    for row in data:
+        offsets.append(pos)
+        pos += len(row)
+    return struct.pack("<IH{0}I".format(len(rows)),h,len(rows),*offsets) + b"".join(data)
+
+class PVS:
+    """Which leaves each leaf can possibly see, from the level's PVS lump. Once a frame begin_frame() finds the player's leaf
+    and render_bsp skips any node with none of its leaves in that leaf's set."""
+    def __init__(self,data,m):
+        self.hash, self.count = struct.unpack_from("<IH",data,0)
+        self.offsets = struct.unpack_from("<{0}I".format(self.count),data,6)
+        self.base = 6 + 4 * self.count
+        self.data = data
+        self.map = m
+        self.leaf = None
+        self.visible_before = [] # visible_before[n] = visible leaves numbered below n
+
+    def row(self,leaf):
+        """Uncompressed bit vector for leaf."""
+        bits = bytearray()
+        size = (self.count + 7) // 8
+        pos = self.base + self.offsets[leaf]
+        while len(bits) < size:
+            c = self.data[pos]
+            if c:
+                bits.append(c)
+                pos += 1
+            else:
+                bits.extend(bytes(self.data[pos+1]))
+                pos += 2
+        return bits
+
+    def locate(self,x,y):
+        """Leaf x,y is in. Walks down like render_bsp does, x,y on a partition counts as its back."""
+        m = self.map
+        n = 0
+        while True:
+            if m.a[n] * x + m.b[n] * y + m.c[n] < 0:
+                if m.left[n] < 0: return m.leaf_first[n]
+                n = m.left[n]
+            else:
+                if m.right[n] < 0: return m.leaf_end[n] - 1
+                n = m.right[n]
+
+    def begin_frame(self,player):
+        leaf = self.locate(player.x,player.y)
+        if leaf == self.leaf:
+            return
+        self.leaf = leaf
+        bits = self.row(leaf)
+        n = 0
+        self.visible_before = [0]
+        for i in range(self.count):
+            if bits[i >> 3] & (1 << (i & 7)):
+                n += 1
+            self.visible_before.append(n)
+
+    def visible(self,n):
+        """Can any leaf under node n be seen from the player's leaf."""
+        return self.visible_before[self.map.leaf_end[n]] != self.visible_before[self.map.leaf_first[n]]
+
+def load_pvs(data,m,h):
+    """PVS for BSPMap m, or None if there's no PVS lump or it was built for a different map."""
+    if not data or not m:
+        return None
+    pvs = PVS(data,m)
+    if pvs.hash != h or m.leaves != pvs.count:
+        print("stale PVS, drawing without it")
+        return None
+    return pvs
+
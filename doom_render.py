@@ -0,0 +1,311 @@
+"""Screen constants, Color and the render backends: PrimeBackend on the calculator, FramebufferBackend (NumPy) anywhere else.
+hpprime only gets imported by make_backend()."""
+hpprime = None
+
+SCREEN_WIDTH = 320
+SCREEN_HEIGHT = 240
+
+class Color:
+    """A color. Uses RGB because it's actually humanly readable and someone did in fact write this code themselves."""
+    def __init__(self,r,g,b):
+        self.R = r
+        self.G = g
+        self.B = b
+
+class RenderBackend:
+    """Everything that actually touches pixels goes through one of these. G1 is the backbuffer, G0 the screen, other grob numbers hold textures.
+    Colors are Color objects or 0xRRGGBB ints. The calculator one also takes GETPIX_P expressions from texel().
+    evals counts the round-trips through the PPL interpreter, that's the number to watch."""
+    evals = 0
+    def fillrect(self,x,y,w,h,edge,fill):
+        raise NotImplementedError
+    def pixel(self,x,y,color):
+        """color is a Color, a 0xRRGGBB int or whatever texel() returned."""
+        raise NotImplementedError
+    def texel(self,surface,x,y):
+        """Color of texture pixel x,y in grob surface, in whatever form pixel() wants it."""
+        raise NotImplementedError
+    def poly(self,points,color):
+        """color is a Color or a 0xRRGGBB int."""
+        raise NotImplementedError
+    def strip(self,x,y0,y1,surface,sx,sv0,sv1):
+        """Scaled copy of the 1 pixel wide texture column sx, rows sv0 to sv1, into screen column x rows y0 to y1 (end exclusive). sv0 > sv1 flips it."""
+        raise NotImplementedError
+    def invert(self,x0,y0,x1,y1):
+        raise NotImplementedError
+    def text(self,surface,x,y,string,color,background):
+        """One line of small text over a filled box, surface 0 is the screen."""
+        raise NotImplementedError
+    def copy(self,dst,dx,dy,src,sx,sy,w,h):
+        """Unscaled copy of a w*h block from grob src to grob dst."""
+        raise NotImplementedError
+    def load_texture(self,surface,fileno):
+        raise NotImplementedError
+    def average(self,surface,x,y,w,h):
+        """Average colour of a w*h block of a grob as 0xRRGGBB."""
+        raise NotImplementedError
+    def read_texture(self,surface,w,h):
+        """Every pixel of the w*h block at the top left of a grob as 0xRRGGBB ints, column by column."""
+        raise NotImplementedError
+    def column(self,surface,x,y,colors):
+        """Writes colors (0xRRGGBB ints) down grob column x starting at row y."""
+        raise NotImplementedError
+    def blit(self,xscale=1,yscale=1):
+        """Present G1. With a scale only the top left SCREEN_WIDTH/xscale by SCREEN_HEIGHT/yscale of it is used, stretched to fill the screen."""
+        raise NotImplementedError
+    def key_down(self,key):
+        raise NotImplementedError
+    def wait(self,seconds):
+        raise NotImplementedError
+
+class PrimeBackend(RenderBackend):
+    """The real thing. Everything but fillrect and blit is an eval. Making one sets up the grobs, which used to be the PPL START() launcher's job."""
+    def __init__(self):
+        self.eval("DIMGROB_P(G1,{0},{1},#000000)".format(SCREEN_WIDTH,SCREEN_HEIGHT))
+        for g in range(2,9):
+            self.eval("DIMGROB_P(G{0},512,512,#000000)".format(g))
+        self.eval("DIMGROB_P(G9,128,128,#000000)")
+    def eval(self,cmd):
+        """hpprime.eval, but counted. Every call is a round-trip through the PPL interpreter."""
+        self.evals += 1
+        return hpprime.eval(cmd)
+    def fillrect(self,x,y,w,h,edge,fill):
+        hpprime.fillrect(1,x,y,w,h,edge,fill)
+    def pixel(self,x,y,color):
+        if isinstance(color,Color):
+            self.eval( "PIXON_P(G1,{0},{1},RGB({2},{3},{4}))".format(str(x),str(y),str(color.R),str(color.G),str(color.B)))
+        else: 
+            self.eval( "PIXON_P(G1,{0},{1},{2})".format(str(x),str(y),str(color)))
+    def texel(self,surface,x,y):
+        return "GETPIX_P(G{0},{1},{2})".format(str(surface),str(x),str(y))
+    def poly(self,points,color):
+        pts = ",".join(["({0},{1})".format(round(px),round(py)) for px,py in points])
+        if isinstance(color,Color):
+            color = "RGB({0},{1},{2})".format(color.R,color.G,color.B)
+        self.eval( "FILLPOLY_P(G1,{0}{1}{2},{3})".format("{",pts,"}",color))
+    def strip(self,x,y0,y1,surface,sx,sv0,sv1):
+        self.eval("BLIT_P(G1,{0},{1},{2},{3},G{4},{5},{6},{7},{8})".format(x,y0,x+1,y1,surface,sx,sv0,sx+1,sv1))
+    def invert(self,x0,y0,x1,y1):
+        self.eval("INVERT_P(G1,{0},{1},{2},{3})".format(x0,y0,x1,y1))
+    def text(self,surface,x,y,string,color,background):
+        self.eval('TEXTOUT_P("{0}",G{1},{2},{3},1,{4},320,{5})'.format(string,surface,x,y,color,background))
+    def copy(self,dst,dx,dy,src,sx,sy,w,h):
+        self.eval("BLIT_P(G{0},{1},{2},{3},{4},G{5},{6},{7},{8},{9})".format(dst,dx,dy,dx+w,dy+h,src,sx,sy,sx+w,sy+h))
+    def load_texture(self,surface,fileno):
+        #print("G{0} := AFiles('{1}');".format(str(surface),fileno))
+        self.eval('G{0} := AFiles("{1}");'.format(str(surface),fileno))
+    def average(self,surface,x,y,w,h,samples=4):
+        """Only reads a samples*samples grid, every GETPIX_P is an eval."""
+        r = g = b = 0
+        for j in range(samples):
+            for i in range(samples):
+                c = int(self.eval("GETPIX_P(G{0},{1},{2})".format(surface,x + (2*i+1)*w//(2*samples),y + (2*j+1)*h//(2*samples))))
+                r += (c >> 16) & 255
+                g += (c >> 8) & 255
+                b += c & 255
+        n = samples * samples
+        return ((r // n) << 16) | ((g // n) << 8) | (b // n)
+    def read_texture(self,surface,w,h):
+        """hpprime.getpix straight, no evals, but it's still w*h calls so textures only get read once."""
+        return [hpprime.getpix(surface,x,y) & 0xFFFFFF for x in range(w) for y in range(h)]
+    def column(self,surface,x,y,colors):
+        for j in range(len(colors)):
+            hpprime.pixon(surface,x,y+j,colors[j])
+    def blit(self,xscale=1,yscale=1):
+        if xscale == 1 and yscale == 1:
+            hpprime.blit(0,0,0,1)
+        else:
+            self.eval("BLIT_P(G0,0,0,{0},{1},G1,0,0,{2},{3})".format(SCREEN_WIDTH,SCREEN_HEIGHT,SCREEN_WIDTH//xscale,SCREEN_HEIGHT//yscale))
+    def key_down(self,key):
+        return self.eval("ISKEYDOWN({0})".format(key))
+    def wait(self,seconds):
+        self.eval("WAIT({0})".format(seconds))
+
+class FramebufferBackend(RenderBackend):
+    """Headless backend for desktop tools. Grobs are NumPy arrays of 0xRRGGBB ints and columns/spans are written with slice assignment.
+    Calls that would be an eval on the calculator still bump evals, so the counts mean the same thing on both.
+    Textures are read from texture_dir with PIL if it's there, otherwise every texture is the same generated brick pattern.
+    window limits drawing into G1 to columns first..last, for rendering the screen in strips (see render_headless.StripRenderer)."""
+    def __init__(self,width=SCREEN_WIDTH,height=SCREEN_HEIGHT,texture_dir="textures"):
+        import numpy
+        self.np = numpy
+        self.width = width
+        self.height = height
+        self.texture_dir = texture_dir
+        self.grobs = {1: numpy.zeros((height,width),dtype=numpy.uint32)}
+        for g in range(2,9): # same grobs START() dims
+            self.grobs[g] = numpy.zeros((512,512),dtype=numpy.uint32)
+        self.grobs[9] = numpy.zeros((128,128),dtype=numpy.uint32)
+        self.screen = numpy.zeros((height,width),dtype=numpy.uint32)
+        self.keys = set() # ISKEYDOWN numbers currently held, for scripted input
+        self.window = (0,width-1)
+
+    def count(self):
+        self.evals += 1
+
+    def rgb(self,color):
+        if type(color) == int:
+            return color & 0xFFFFFF
+        return (int(color.R) << 16) | (int(color.G) << 8) | int(color.B)
+
+    def fillrect(self,x,y,w,h,edge,fill):
+        fb = self.grobs[1]
+        first, last = self.window
+        x0 = max(x,0)
+        y0 = max(y,0)
+        x1 = min(x+w,self.width)
+        y1 = min(y+h,self.height)
+        if x0 >= x1 or y0 >= y1: return
+        fb[y0:y1,max(x0,first):min(x1,last+1)] = self.rgb(edge)
+        fb[y0+1:y1-1,max(x0+1,first):min(x1-1,last+1)] = self.rgb(fill)
+
+    def pixel(self,x,y,color):
+        self.count()
+        x = int(x)
+        y = int(y)
+        if self.window[0] <= x <= self.window[1] and 0 <= y < self.height:
+            self.grobs[1][y,x] = self.rgb(color)
+
+    def texel(self,surface,x,y):
+        tex = self.grobs[surface]
+        return int(tex[int(y) % tex.shape[0],int(x) % tex.shape[1]])
+
+    def poly(self,points,color):
+        """Even-odd fill of the rounded polygon, like FILLPOLY_P."""
+        np = self.np
+        self.count()
+        pts = [(round(px),round(py)) for px,py in points]
+        xs = [p[0] for p in pts]
+        ys = [p[1] for p in pts]
+        x0 = max(min(xs),self.window[0])
+        x1 = min(max(xs)+1,self.window[1]+1)
+        y0 = max(min(ys),0)
+        y1 = min(max(ys)+1,self.height)
+        if x0 >= x1 or y0 >= y1: return
+        gy, gx = np.mgrid[y0:y1,x0:x1]
+        gx = gx + 0.5
+        gy = gy + 0.5
+        inside = np.zeros(gx.shape,dtype=bool)
+        for k in range(len(pts)):
+            ax,ay = pts[k]
+            bx,by = pts[k-1]
+            if ay == by: continue
+            crosses = (ay > gy) != (by > gy)
+            inside ^= crosses & (gx < (bx-ax) * (gy-ay) / (by-ay) + ax)
+        self.grobs[1][y0:y1,x0:x1][inside] = self.rgb(color)
+
+    def strip(self,x,y0,y1,surface,sx,sv0,sv1):
+        np = self.np
+        self.count()
+        if not self.window[0] <= x <= self.window[1] or y1 <= y0: return
+        tex = self.grobs[surface]
+        rows = np.arange(max(y0,0),min(y1,self.height))
+        if not len(rows): return
+        # nearest texel row for the centre of each target row
+        src = np.floor(sv0 + (rows - y0 + 0.5) * (sv1 - sv0) / (y1 - y0)).astype(np.int64)
+        src = np.clip(src,0,tex.shape[0]-1)
+        self.grobs[1][rows[0]:rows[-1]+1,x] = tex[src,int(sx) % tex.shape[1]]
+
+    def invert(self,x0,y0,x1,y1):
+        self.count()
+        self.grobs[1][max(y0,0):y1+1,max(x0,self.window[0]):min(x1,self.window[1])+1] ^= 0xFFFFFF
+
+    def text(self,surface,x,y,string,color,background):
+        """Needs PIL for the glyphs, without it only the box gets drawn."""
+        np = self.np
+        self.count()
+        w = min(6 * len(string) + 2,self.width - x)
+        h = min(11,self.height - y)
+        if w <= 0 or h <= 0: return
+        fb = self.screen if surface == 0 else self.grobs[surface]
+        fb[y:y+h,x:x+w] = self.rgb(background)
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            return
+        img = Image.new("1",(w,h),0)
+        ImageDraw.Draw(img).text((1,0),string,fill=1)
+        mask = np.asarray(img,dtype=bool)
+        fb[y:y+h,x:x+w][mask] = self.rgb(color)
+
+    def copy(self,dst,dx,dy,src,sx,sy,w,h):
+        self.count()
+        self.grobs[dst][dy:dy+h,dx:dx+w] = self.grobs[src][sy:sy+h,sx:sx+w]
+
+    def load_texture(self,surface,fileno):
+        np = self.np
+        self.count()
+        try:
+            from PIL import Image
+            img = Image.open(self.texture_dir + "/" + fileno).convert("RGB")
+            a = np.asarray(img,dtype=np.uint32)
+            tex = (a[:,:,0] << 16) | (a[:,:,1] << 8) | a[:,:,2]
+        except (ImportError, OSError):
+            gy, gx = np.mgrid[0:128,0:128]
+            mortar = (gy % 32 < 2) | (((gx + (gy // 32 % 2) * 32) % 64) < 2)
+            tex = np.where(mortar,0xB0B0B0,0x9C3A22).astype(np.uint32)
+        self.grobs[surface] = tex
+
+    def average(self,surface,x,y,w,h):
+        self.count()
+        block = self.grobs[surface][y:y+h,x:x+w]
+        r = int(((block >> 16) & 255).mean())
+        g = int(((block >> 8) & 255).mean())
+        b = int((block & 255).mean())
+        return (r << 16) | (g << 8) | b
+
+    def read_texture(self,surface,w,h):
+        return self.grobs[surface][:h,:w].T.flatten().tolist()
+
+    def column(self,surface,x,y,colors):
+        self.grobs[surface][y:y+len(colors),x] = colors
+
+    def blit(self,xscale=1,yscale=1):
+        if xscale == 1 and yscale == 1:
+            self.screen[:,:] = self.grobs[1]
+        else:
+            self.count()
+            small = self.grobs[1][:self.height//yscale,:self.width//xscale]
+            self.screen[:,:] = small.repeat(yscale,axis=0).repeat(xscale,axis=1)
+
+    def key_down(self,key):
+        self.count()
+        return key in self.keys
+
+    def wait(self,seconds):
+        self.count()
+
+    def save_ppm(self,path):
+        """Writes the last presented frame as a binary PPM."""
+        np = self.np
+        s = self.screen
+        rgb = np.dstack(((s >> 16) & 255,(s >> 8) & 255,s & 255)).astype(np.uint8)
+        f = open(path,"wb")
+        f.write("P6\n{0} {1}\n255\n".format(self.width,self.height).encode())
+        f.write(rgb.tobytes())
+        f.close()
+
+    def save_png(self,path):
+        """Same as save_ppm but a PNG. Only needs zlib."""
+        import zlib, struct
+        np = self.np
+        s = self.screen
+        rgb = np.dstack(((s >> 16) & 255,(s >> 8) & 255,s & 255)).astype(np.uint8)
+        raw = b"".join([b"\x00" + rgb[y].tobytes() for y in range(self.height)])
+        def chunk(kind,data):
+            return struct.pack(">I",len(data)) + kind + data + struct.pack(">I",zlib.crc32(kind + data) & 0xFFFFFFFF)
+        f = open(path,"wb")
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR",struct.pack(">IIBBBBB",self.width,self.height,8,2,0,0,0)))
+        f.write(chunk(b"IDAT",zlib.compress(raw)))
+        f.write(chunk(b"IEND",b""))
+        f.close()
+
+def make_backend():
+    """PrimeBackend if hpprime is there, otherwise the headless FramebufferBackend."""
+    global hpprime
+    try:
+        import hpprime
+    except ImportError: # not on the calculator, render into the headless framebuffer instead
+        return FramebufferBackend()
+    return PrimeBackend()
@@ -0,0 +1,227 @@
+"""Texture loading: the LRU atlas over G2-G7 (TextureTree), decoding into palettes and light band colormaps, and the
+ColumnCache of shaded columns on G8."""
+from doom_render import Color
+
+LIGHT_BANDS = 8 # distance shading levels, one colormap per texture each
+LIGHT_DISTANCE = 16 # depth where the darkest band starts
+LIGHT_MIN = 0.25 # how bright the darkest band is
+
+class Texture:
+    """Texture file"""
+    def __init__(self,fileno):
+        self.fileno = fileno
+    def load_file(self,backend,surface=9):
+        backend.load_texture(surface,self.fileno)
+
+def palettize(texels):
+    """Palette indices for a list of 0xRRGGBB texels. Drops low bits off every channel until there are 256 colours or fewer.
+    Returns (bytearray of indices, palette list)."""
+    for bits in range(8):
+        keep = (0xFF << bits) & 0xFF
+        mask = (keep << 16) | (keep << 8) | keep
+        colors = set([c & mask for c in texels])
+        if len(colors) <= 256:
+            break
+    half = ((1 << bits) >> 1) * 0x010101 # middle of the dropped range
+    palette = []
+    index = {}
+    for c in colors:
+        index[c] = len(palette)
+        palette.append(c | half)
+    return bytearray([index[c & mask] for c in texels]), palette
+
+def band_light(band):
+    """Brightness of light band band, 1 up close down to LIGHT_MIN."""
+    return 1 - (1 - LIGHT_MIN) * band / (LIGHT_BANDS - 1)
+
+def shade_rgb(rgb,light):
+    return (int(((rgb >> 16) & 255) * light) << 16) | (int(((rgb >> 8) & 255) * light) << 8) | int((rgb & 255) * light)
+
+class TextureTree:
+    """Sorta like camera class but for textures. Loaded textures live in an atlas over G2-G7 (a 512x512 grob fits 16 128x128 textures),
+    when it's full the least recently used one gets kicked out. G9 is only where AFiles lands before being copied into a slot.
+    For shading a texture also gets decoded once into palette indices plus one colormap per light band, see decoded()."""
+    def __init__(self,backend,surface=9,atlas=(2,3,4,5,6,7),atlas_size=512,tile=128):
+        self.backend = backend
+        self.tree = {}
+        self.loaded = "nil" # last texture that went through G9
+        self.surface = surface
+        self.tile = tile
+        self.free = [(g,x,y) for g in atlas for y in range(0,atlas_size,tile) for x in range(0,atlas_size,tile)]
+        self.free.reverse() # pop() hands them out in order
+        self.size = len(self.free)
+        self.cached = {} # fileno -> (surface,x,y)
+        self.colors = {} # fileno -> average 0xRRGGBB, stays when the texture is evicted
+        self.decodes = {} # fileno -> (indices column by column, [colormap per light band])
+        self.last_used = {} # fileno -> tick
+        self.tick = 0
+        self.frame_tick = 0 # tick at the start of the frame
+        self.last_frame_tick = 0 # and of the frame before, prefetch won't evict anything used since then
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.decodings = 0 # textures loaded to be decoded, they don't take a slot
+
+    def add_texture(self,fileno):
+        self.tree[fileno] = Texture(fileno)
+
+    def new_frame(self):
+        self.last_frame_tick = self.frame_tick
+        self.frame_tick = self.tick
+
+    def evict(self,before=None):
+        """Frees the least recently used slot. With before, only textures last used before that tick count. Returns False if nothing could go."""
+        victim = None
+        for fileno in self.cached:
+            if before is not None and self.last_used[fileno] >= before: continue
+            if victim is None or self.last_used[fileno] < self.last_used[victim]:
+                victim = fileno
+        if victim is None:
+            return False
+        self.free.append(self.cached.pop(victim))
+        del self.last_used[victim]
+        self.evictions += 1
+        return True
+
+    def load_texture(self,fileno):
+        if not self.free:
+            self.evict()
+        slot = self.free.pop()
+        self.loaded = fileno
+        self.tree[fileno].load_file(self.backend,self.surface)
+        self.backend.copy(slot[0],slot[1],slot[2],self.surface,0,0,self.tile,self.tile)
+        self.cached[fileno] = slot
+        if fileno not in self.colors:
+            self.colors[fileno] = self.backend.average(self.surface,0,0,self.tile,self.tile)
+        return slot
+
+    def decoded(self,fileno):
+        """(indices,colormaps) for fileno: palette indices column by column and a palette already shaded for each light band.
+        Decoding reads the whole texture back once, after that shading a texel is two table lookups."""
+        d = self.decodes.get(fileno)
+        if d is None:
+            self.loaded = fileno
+            self.tree[fileno].load_file(self.backend,self.surface)
+            indices, palette = palettize(self.backend.read_texture(self.surface,self.tile,self.tile))
+            d = (indices,[[shade_rgb(c,band_light(band)) for c in palette] for band in range(LIGHT_BANDS)])
+            self.decodes[fileno] = d
+            self.decodings += 1
+        return d
+
+    def get_color(self,fileno):
+        """Average colour of a texture, for walls drawn flat. Loads it the first time."""
+        if fileno not in self.colors:
+            self.get_texture_slot(fileno)
+        return self.colors[fileno]
+
+    def prefetch_texture(self,fileno):
+        """Loads a texture that's about to be drawn. Only takes free slots or ones neither this frame nor the last has touched,
+        so a view that stays put never swaps out what it's drawing. False once there's no slot it's allowed to take."""
+        if fileno in self.cached:
+            self.last_used[fileno] = self.tick # still wanted, keep it from ageing out
+            return True
+        if not self.free and not self.evict(self.last_frame_tick):
+            return False
+        self.load_texture(fileno)
+        self.last_used[fileno] = self.tick
+        self.prefetches += 1
+        return True
+
+    def stats(self):
+        return {"slots": self.size, "used": len(self.cached), "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "prefetches": self.prefetches, "decodings": self.decodings}
+
+    def find_texcolumn(self,sx,x0,x1,w=128):
+        t = (sx - x0) / (x1 - x0)
+        return int(t * w) % w
+    
+    def find_texrow(self,sx,sy,x0,x1,y0up,y0down,y1up,y1down,h=128):
+        t = (sx-x0) / (x1-x0)
+        y0 = y0up + t * (y1up - y0up)
+        y1 = y0down + t * (y1down - y0down)
+        v = (sy - y0) / (y1-y0)
+        v = min(0,min(1,v))
+        return int(v*h) % h
+    
+    def find_texpix(self,sx,sy,x0,x1,y0up,y0down,y1up,y1down,w=128,h=128):
+        return self.find_texcolumn(sx,x0,x1,w), self.find_texrow(sx,sy,x0,x1,y0up,y0down,y1up,y1down,h)
+    
+
+    def get_texture_slot(self,fileno):
+        """Makes sure fileno is cached and returns (grob,x,y) of its top left corner."""
+        self.tick += 1
+        slot = self.cached.get(fileno)
+        if slot is None:
+            self.misses += 1
+            slot = self.load_texture(fileno)
+        else:
+            self.hits += 1
+        self.last_used[fileno] = self.tick
+        return slot
+
+    def get_texture_pixel(self,fileno,x,y):
+        slot = self.get_texture_slot(fileno)
+        return self.backend.texel(slot[0],slot[1]+x,slot[2]+y)
+        # print("E"+col)
+       # return graphic.get_pixel(9,x%128,y%128) #col = str(this)
+        #if len(col) < 9:
+        col += "0"*(9-len(col))
+        rr = int(col[0:3])
+        gg = int(col[3:6])
+        bb = int(col[6:9])
+        try:
+            return Color(rr,gg,bb)
+        except ValueError:
+            print("!")
+            return Color(0,0,0)
+
+
+
+class ColumnCache:
+    """Texture columns already run through a light band's colormap, kept one per pixel column of a grob so drawing a shaded strip
+    is the same single BLIT_P as an unshaded one. Keyed by (texture,u,band). When it's full the least recently used quarter goes."""
+    def __init__(self,backend,surface=8,size=512,h=128):
+        self.backend = backend
+        self.surface = surface
+        self.h = h
+        self.free = [(x,y) for y in range(size - h,-1,-h) for x in range(size - 1,-1,-1)] # pop() hands out top left first
+        self.size = len(self.free)
+        self.cached = {} # (fileno,u,band) -> (surface,x,y)
+        self.last_used = {}
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def evict(self):
+        keys = sorted(self.cached,key=lambda k: self.last_used[k])
+        for key in keys[:max(1,len(keys) // 4)]:
+            slot = self.cached.pop(key)
+            self.free.append((slot[1],slot[2]))
+            del self.last_used[key]
+            self.evictions += 1
+
+    def get(self,ttree,fileno,u,band):
+        """(grob,x,y) of the top of column u of fileno shaded for band."""
+        key = (fileno,u,band)
+        self.tick += 1
+        slot = self.cached.get(key)
+        if slot is None:
+            self.misses += 1
+            if not self.free:
+                self.evict()
+            x, y = self.free.pop()
+            indices, colormaps = ttree.decoded(fileno)
+            colormap = colormaps[band]
+            h = self.h
+            self.backend.column(self.surface,x,y,[colormap[i] for i in indices[u*h:(u+1)*h]])
+            slot = (self.surface,x,y)
+            self.cached[key] = slot
+        else:
+            self.hits += 1
+        self.last_used[key] = self.tick
+        return slot
+
+    def stats(self):
+        return {"slots": self.size, "used": len(self.cached), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
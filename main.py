@@ -0,0 +1,4 @@
+"""The calculator starts here: copy doom*.py, main.py, doom.wad and the textures into a Python app and run it."""
+import doom
+
+doom.run()
@@ -0,0 +1,136 @@
+"""Packs the level sources in maps/ into the WAD doom.py loads its levels from. Only needs doom_map.
+
+    python make_wad.py [--jobs N] [out] [maps/E1M1.txt ...]
+
+Each level source has one wall per line, "x0 y0 x1 y1 [texture]", # starts a comment. The level is named after the file.
+Its BSP is compiled into the NODES lump with the same builder settings doom.py uses, so the calculator never has to build it.
+The PVS lump (which leaves of that tree can see which) is worked out here too, one leaf per task over a process pool.
+"""
+import argparse
+import glob
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import doom_map
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def read_source(path,default_texture):
+    """[(x0,y0,x1,y1,texture)] from a level source file."""
+    walls = []
+    f = open(path)
+    for line in f:
+        line = line.split("#")[0].split()
+        if not line: continue
+        texture = line[4] if len(line) > 4 else default_texture
+        walls.append((float(line[0]),float(line[1]),float(line[2]),float(line[3]),texture))
+    f.close()
+    return walls
+
+pvs_job = None # portals per leaf in each pool worker
+
+def pvs_init(portals):
+    global pvs_job
+    pvs_job = portals
+
+def pvs_task(i):
+    return doom_map.pvs_row(i,pvs_job)
+
+def level_pvs(m,linedefs,h,jobs=None):
+    """PVS lump for BSPMap m. Every leaf floods out through the portals between leaves, and since visibility goes both ways
+    whatever one side of a pair finds goes in both rows."""
+    count = m.leaves
+    minx, miny, maxx, maxy = doom_map.bounding_box(linedefs)
+    box = [(minx-1,miny-1),(maxx+1,miny-1),(maxx+1,maxy+1),(minx-1,maxy+1)]
+    portals = doom_map.leaf_portals(doom_map.leaf_regions(m,box),linedefs)
+    if jobs == 1:
+        pvs_init(portals)
+        found = [pvs_task(i) for i in range(count)]
+    else:
+        pool = ProcessPoolExecutor(jobs,initializer=pvs_init,initargs=(portals,))
+        found = list(pool.map(pvs_task,range(count)))
+        pool.shutdown()
+    rows = [set() for i in range(count)]
+    for i in range(count):
+        for j in found[i]:
+            rows[i].add(j)
+            rows[j].add(i)
+    rows = [sorted(row) for row in rows]
+    return doom_map.pack_pvs(rows,h), sum([len(row) for row in rows]) / max(1,count)
+
+def level_lumps(walls,jobs=None):
+    """VERTEXES, LINEDEFS and TEXTURES for a level, then NODES compiled from exactly what doom_map.level_walls reads back out of them, and its PVS."""
+    index = {}
+    coords = []
+    textures = []
+    lines = []
+    for x0,y0,x1,y1,texture in walls:
+        ends = []
+        for key in ((x0,y0),(x1,y1)):
+            if key not in index:
+                index[key] = len(index)
+                coords.extend(key)
+            ends.append(index[key])
+        if texture not in textures:
+            textures.append(texture)
+        lines.extend((ends[0],ends[1],textures.index(texture)))
+    lumps = {}
+    lumps["VERTEXES"] = struct.pack("<{0}f".format(len(coords)),*coords)
+    lumps["LINEDEFS"] = struct.pack("<{0}h".format(len(lines)),*lines)
+    names = [struct.pack("<H",len(textures))]
+    for name in textures:
+        names.append(struct.pack("<B",len(name)) + name.encode())
+    lumps["TEXTURES"] = b"".join(names)
+
+    builder = doom_map.BSPBuilder() # the settings doom.init() builds with
+    linedefs = doom_map.level_walls(lumps)
+    h = doom_map.map_hash(linedefs,builder)
+    tree = doom_map.build_bsp(linedefs,builder)
+    vertices = doom_map.build_vertex_table(tree)
+    lumps["NODES"] = doom_map.pack_map(tree,vertices,h)[0]
+    m = doom_map.unpack_map(lumps["NODES"]) # the PVS is numbered off exactly what the game will load
+    stats = builder.stats()
+    lumps["PVS"], stats["visible"] = level_pvs(m,linedefs,h,jobs)
+    stats["leaves"] = m.leaves
+    return lumps, stats
+
+def write_wad(path,entries):
+    """entries is [(name,bytes)] in directory order."""
+    data = []
+    directory = []
+    pos = 12
+    for name, blob in entries:
+        directory.append(struct.pack("<ii8s",pos,len(blob),name.encode()))
+        data.append(blob)
+        pos += len(blob)
+    f = open(path,"wb")
+    f.write(struct.pack("<4sii",b"PWAD",len(entries),pos))
+    f.write(b"".join(data))
+    f.write(b"".join(directory))
+    f.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out",nargs="?",default=os.path.join(HERE,"doom.wad"))
+    parser.add_argument("sources",nargs="*",help="level sources, every maps/*.txt by default")
+    parser.add_argument("--jobs",type=int,default=None,help="processes for the PVS, one per CPU by default")
+    args = parser.parse_args(argv)
+    out = args.out
+    sources = args.sources or sorted(glob.glob(os.path.join(HERE,"maps","*.txt")))
+    jobs = args.jobs
+    entries = []
+    for path in sources:
+        name = os.path.splitext(os.path.basename(path))[0].upper()
+        walls = read_source(path,doom_map.DEFAULT_TEXTURE)
+        lumps, stats = level_lumps(walls,jobs)
+        entries.append((name,b""))
+        for lump in doom_map.LEVEL_LUMPS:
+            entries.append((lump,lumps[lump]))
+        print("{0}: {1} walls, {2} nodes, {3} splits, depth {4}, {5} leaves seeing {6:.1f} each".format(
+            name,len(walls),stats["nodes"],stats["splits"],stats["depth"],stats["leaves"],stats["visible"]))
+    write_wad(out,entries)
+    print("{0}: {1} bytes".format(out,os.path.getsize(out)))
+
+if __name__ == "__main__":
+    main()
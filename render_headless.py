@@ -0,0 +1,133 @@
+"""Renders doom.py frames on a desktop with the NumPy framebuffer backend.
+
+    python render_headless.py frame.png --x 0 --y 0 --r 0
+    python render_headless.py frame.png --jobs 4
+
+load_doom() imports doom and init()s it, which picks the headless backend
+when hpprime isn't there.
+
+With --jobs the screen is split into vertical strips and each strip is drawn by
+a pool worker straight into a shared memory G1 (see StripRenderer). The frame
+comes out pixel for pixel the same as rendering it in one go.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+def load_doom():
+    """The doom module, init()ed. Calling it again starts over with a fresh game in the same module."""
+    import doom
+    doom.init()
+    return doom
+
+def render(doom,x,y,r,spans=True):
+    """Renders and presents one frame from pose x,y,r (degrees). Returns (seconds, evals)."""
+    doom.plr.x = x
+    doom.plr.y = y
+    doom.plr.r = r * doom.RAD_CONST
+    doom.cam.spans = spans
+    start = doom.backend.evals
+    t = time.perf_counter()
+    doom.render_frame()
+    doom.draw_crosshair()
+    doom.backend.blit()
+    return time.perf_counter() - t, doom.backend.evals - start
+
+strip_job = None # (doom, shared memory) in each pool worker
+
+def strip_init(name,texture_dir):
+    import numpy
+    doom = load_doom()
+    doom.backend.texture_dir = texture_dir
+    shm = shared_memory.SharedMemory(name=name)
+    doom.backend.grobs[1] = numpy.ndarray(doom.backend.grobs[1].shape,dtype=numpy.uint32,buffer=shm.buf)
+    global strip_job
+    strip_job = (doom,shm)
+
+def strip_task(args):
+    """Draws screen columns first..last of the frame at pose x,y,r into the shared G1. Returns the evals it took."""
+    x, y, r, spans, shading, xscale, yscale, first, last = args
+    doom = strip_job[0]
+    doom.plr.x = x
+    doom.plr.y = y
+    doom.plr.r = r * doom.RAD_CONST
+    doom.cam.spans = spans
+    doom.cam.shading = shading
+    doom.cam.xscale = xscale
+    doom.cam.yscale = yscale
+    doom.cam.window = (first,last)
+    doom.backend.window = (first // xscale,last // xscale)
+    start = doom.backend.evals
+    doom.render_frame()
+    return doom.backend.evals - start
+
+class StripRenderer:
+    """Renders doom's frames over a pool of jobs workers, one vertical strip each. doom's G1 is swapped for a
+    shared memory array the workers write into, so no pixels get pickled. Every worker has its own copy of the game
+    with the whole screen in its clipper and only draws its own columns, which is why the strips add up to the
+    exact same frame. Call close() when done."""
+    def __init__(self,doom,jobs=None,texture_dir="textures"):
+        import numpy
+        self.doom = doom
+        self.jobs = jobs or os.cpu_count() or 1
+        fb = doom.backend.grobs[1]
+        self.shm = shared_memory.SharedMemory(create=True,size=fb.nbytes)
+        doom.backend.grobs[1] = numpy.ndarray(fb.shape,dtype=numpy.uint32,buffer=self.shm.buf)
+        self.pool = ProcessPoolExecutor(self.jobs,initializer=strip_init,initargs=(self.shm.name,texture_dir))
+
+    def strips(self):
+        """(first,last) screen columns per strip, on whole scaled columns."""
+        xs = self.doom.cam.xscale
+        columns = self.doom.SCREEN_WIDTH // xs
+        bounds = [columns * k // self.jobs * xs for k in range(self.jobs + 1)]
+        return [(bounds[k],bounds[k+1]-1) for k in range(self.jobs) if bounds[k] < bounds[k+1]]
+
+    def render(self,x,y,r,spans=True):
+        """Like render(): one frame from pose x,y,r (degrees) with the crosshair, presented. Returns (seconds, evals)."""
+        doom = self.doom
+        cam = doom.cam
+        t = time.perf_counter()
+        tasks = [(x,y,r,spans,cam.shading,cam.xscale,cam.yscale,first,last) for first,last in self.strips()]
+        evals = sum(self.pool.map(strip_task,tasks))
+        start = doom.backend.evals
+        doom.draw_crosshair()
+        doom.backend.blit(cam.xscale,cam.yscale)
+        return time.perf_counter() - t, evals + doom.backend.evals - start
+
+    def close(self):
+        self.pool.shutdown()
+        fb = self.doom.backend.grobs[1]
+        self.doom.backend.grobs[1] = fb.copy()
+        del fb
+        self.shm.close()
+        self.shm.unlink()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out",help="output image, .png or .ppm")
+    parser.add_argument("--x",type=float,default=0)
+    parser.add_argument("--y",type=float,default=0)
+    parser.add_argument("--r",type=float,default=0,help="view angle in degrees")
+    parser.add_argument("--pixels",action="store_true",help="use the per-pixel path instead of strips")
+    parser.add_argument("--textures",default="textures",help="directory with the texture files")
+    parser.add_argument("--jobs",type=int,default=0,help="render in this many strips on a process pool, 0 for one go in this process")
+    args = parser.parse_args(argv)
+
+    doom = load_doom()
+    doom.backend.texture_dir = args.textures
+    if args.jobs:
+        renderer = StripRenderer(doom,args.jobs,args.textures)
+        seconds, evals = renderer.render(args.x,args.y,args.r,not args.pixels)
+        renderer.close()
+    else:
+        seconds, evals = render(doom,args.x,args.y,args.r,not args.pixels)
+    if args.out.lower().endswith(".ppm"):
+        doom.backend.save_ppm(args.out)
+    else:
+        doom.backend.save_png(args.out)
+    print("{0}: {1:.1f} ms, {2} evals".format(args.out,seconds * 1000,evals))
+
+if __name__ == "__main__":
+    main()